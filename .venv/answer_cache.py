@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95 # Similaridade de cosseno mínima entre as perguntas para reaproveitar a resposta
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 3600
+SEARCH_CANDIDATES = 8 # Perguntas parecidas conferidas por busca (podem ter recuperado chunks diferentes)
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respostas da IA para perguntas quase idênticas, em memória.
+    A chave é o embedding normalizado da pergunta (busca por similaridade em um índice FAISS exato, produto interno)
+    mais o contexto do prompt: o conjunto de IDs dos chunks da base recuperados e um hash do histórico de chat enviado.
+    Uma resposta só é reaproveitada se a pergunta for parecida o bastante (similarity_threshold) E o contexto for o mesmo,
+    então perguntas genéricas de continuação ("Pode explicar melhor?") não cruzam conversas diferentes.
+    Entradas saem por LRU (max_entries) ou TTL.
+    Todo lookup/store informa a versão do índice da base (RAGSystem.index_version); se ela mudar, o cache é esvaziado.
+    """
+
+    def __init__(self, dimension: int, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.dimension = dimension
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._entries = OrderedDict() # ID da entrada -> {"context", "answer", "expires_at"} (LRU)
+        self._next_id = 0
+        self._index_version = None
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+
+    def _remove(self, entry_ids: list[int]):
+        if entry_ids:
+            self._index.remove_ids(np.array(entry_ids, dtype='int64'))
+            for entry_id in entry_ids:
+                del self._entries[entry_id]
+
+    def _check_index_version(self, index_version: str | None):
+        # Chamado com o lock: a base foi reindexada, as respostas podem citar chunks que mudaram
+        if index_version != self._index_version:
+            if self._entries:
+                logger.info('[Answer Cache] Índice da base mudou. %s resposta(s) descartada(s).', len(self._entries))
+                self._counters["invalidations"] += 1
+            self._index.reset()
+            self._entries.clear()
+            self._index_version = index_version
+
+    def _find(self, question_embedding: np.ndarray, context: tuple) -> int | None:
+        """ID da entrada válida mais parecida com a pergunta e com o mesmo contexto, ou None. Chamado com o lock."""
+        if self._index.ntotal == 0:
+            return None
+        scores, ids = self._index.search(question_embedding.reshape(1, -1).astype('float32'), min(SEARCH_CANDIDATES, self._index.ntotal))
+        now = time.time()
+        expired = []
+        found = None
+        for score, entry_id in zip(scores[0], ids[0]):
+            if entry_id == -1 or score < self.similarity_threshold:
+                break # Resultados vêm em ordem decrescente de similaridade
+            entry = self._entries[int(entry_id)]
+            if entry["expires_at"] < now:
+                expired.append(int(entry_id))
+            elif entry["context"] == context:
+                found = int(entry_id)
+                break
+        self._remove(expired)
+        self._counters["evictions"] += len(expired)
+        return found
+
+    def lookup(self, question_embedding: np.ndarray, chunk_ids: list[int], history_key: str, index_version: str | None) -> str | None:
+        """Resposta guardada para uma pergunta parecida com os mesmos chunks e o mesmo histórico, ou None (miss)."""
+        with self._lock:
+            self._check_index_version(index_version)
+            entry_id = self._find(question_embedding, (frozenset(chunk_ids), history_key))
+            if entry_id is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self._counters["hits"] += 1
+            return self._entries[entry_id]["answer"]
+
+    def store(self, question_embedding: np.ndarray, chunk_ids: list[int], history_key: str, answer: str, index_version: str | None):
+        with self._lock:
+            self._check_index_version(index_version)
+            context = (frozenset(chunk_ids), history_key)
+            # Duas requisições com a mesma pergunta podem errar o cache ao mesmo tempo; mantém só a última resposta
+            existing_id = self._find(question_embedding, context)
+            if existing_id is not None:
+                self._remove([existing_id])
+
+            while len(self._entries) >= self.max_entries:
+                self._remove([next(iter(self._entries))])
+                self._counters["evictions"] += 1
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(question_embedding.reshape(1, -1).astype('float32'), np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = {"context": context, "answer": answer, "expires_at": time.time() + self.ttl_seconds}
+
+    def clear(self):
+        with self._lock:
+            self._index.reset()
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
+
+    def render_prometheus(self) -> str:
+        stats = self.stats()
+        lines = [
+            "# HELP harvey_answer_cache_entries Respostas guardadas no cache semântico.",
+            "# TYPE harvey_answer_cache_entries gauge",
+            f"harvey_answer_cache_entries {stats['entries']}",
+        ]
+        for counter in ("hits", "misses", "evictions", "invalidations"):
+            lines.append(f"# TYPE harvey_answer_cache_{counter}_total counter")
+            lines.append(f"harvey_answer_cache_{counter}_total {stats[counter]}")
+        return "\n".join(lines) + "\n"
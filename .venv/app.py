@@ -0,0 +1,654 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from flask import Flask, Response, request, jsonify, render_template, session
+from dotenv import load_dotenv
+import numpy as np
+
+# Importa a classe e as funções dos novos módulos
+from rag import RAGSystem
+from context_assembly import estimate_tokens, fill_chunk_budget, mmr_rank, select_history, select_passages
+from document_store import DocumentStore
+from upload_jobs import UploadJobManager, NO_TEXT_PDF_MESSAGE
+from llm_backends import create_llm_backend, LLMResponseInterrupted, LLMEmptyResponse
+from answer_cache import SemanticAnswerCache
+from metrics import stage_metrics, timed
+
+
+load_dotenv()
+
+# Logs por requisição (prefixo [/ask] etc.) ficam em DEBUG; use LOG_LEVEL=DEBUG para vê-los
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+SECRET_KEY = os.getenv("SECRET_KEY")
+
+
+# --- Configuração do RAG e IA ---
+KB_DIRECTORY = os.getenv("KB_DIRECTORY", "knowledge_base")
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+TOP_K_CHUNKS = 10 # Quantidade de chunks da BASE DE CONHECIMENTO a buscar por fonte (pergunta OU cada chunk do arquivo atual)
+MMR_CANDIDATES = 20 # Melhores chunks (por score) reordenados pelo MMR
+MMR_LAMBDA = 0.7 # Peso da relevância frente à diversidade no MMR (1.0 = só relevância)
+COMBINED_TOP_K_CHUNKS = 7 # Quantidade total de chunks da BASE DE CONHECIMENTO a considerar após combinar fontes
+# Orçamento de tokens (estimados) de cada seção do prompt; o texto do arquivo anterior usado na busca direta continua completo
+CONTEXT_TOKEN_BUDGETS = {
+    "kb": 2000,
+    "current_file": 3000,
+    "previous_file": 1500,
+    "history": 1000,
+}
+DOCUMENT_STORE_PATH = os.getenv("DOCUMENT_STORE_PATH", "session_documents.sqlite3") # Texto completo e índice invertido dos arquivos anexados, por sessão
+DOCUMENT_STORE_TTL = 3600 # Segundos sem acesso até um arquivo anexado ser descartado
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "0")) or None # Processos para OCR/extração dos arquivos anexados (0/None = todos os núcleos)
+UPLOAD_PROCESSING_TIMEOUT = 300 # Segundos que o /ask espera o processamento de um arquivo anexado
+RAG_CACHE_DIRECTORY = os.getenv("RAG_CACHE_DIRECTORY", "rag_cache") # Índice FAISS, chunks e manifesto persistidos entre execuções
+KB_INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", "0")) or None # Processos para extrair os PDFs da base (0/None = todos os núcleos)
+RAG_INDEX_BACKEND = os.getenv("RAG_INDEX_BACKEND", "flat") # flat, flat_fp16, hnsw, ivf_flat ou ivf_pq (ver index_backends.py)
+RAG_NPROBE = int(os.getenv("RAG_NPROBE", "16")) # Listas visitadas por busca nos backends IVF
+RAG_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "64")) # Candidatos por busca no backend HNSW
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini") # gemini ou fake (resposta local, sem rede, para desenvolvimento e testes)
+GEMINI_MODEL_NAME = 'models/gemini-2.0-flash'
+
+MAX_HISTORY_TURNS = 5 # Número de turnos de chat de texto a considerar no histórico
+
+# Cache semântico de respostas (só para perguntas sem arquivo): pergunta parecida + mesmos chunks da base = mesma resposta
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024")) # Respostas guardadas (0 desliga o cache)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")) # Similaridade de cosseno mínima entre as perguntas
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600")) # Segundos até uma resposta guardada expirar
+
+
+# Inicializa o sistema RAG e o modelo Gemini
+# A inicialização do Tesseract agora está dentro do módulo processing.py
+rag_system = None
+llm_backend = None
+
+if __name__ == "__mp_main__":
+    # Processos do pool de uploads (forkserver/spawn) reimportam este arquivo; eles só executam funções de upload_jobs
+    pass
+elif GOOGLE_API_KEY or LLM_BACKEND == "fake":
+    logger.info("Chave API encontrada. Configurando a API Google AI..." if GOOGLE_API_KEY else "Usando o backend de IA local (fake).")
+    try:
+        logger.info("Inicializando o backend de IA '%s'...", LLM_BACKEND)
+        llm_backend = create_llm_backend(LLM_BACKEND, gemini_model_name=GEMINI_MODEL_NAME)
+        logger.info('Backend de IA inicializado com sucesso!')
+
+        # Inicializa o sistema RAG
+        rag_system = RAGSystem(
+            kb_directory=KB_DIRECTORY,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            cache_directory=RAG_CACHE_DIRECTORY,
+            ingest_workers=KB_INGEST_WORKERS,
+            index_backend=RAG_INDEX_BACKEND,
+            nprobe=RAG_NPROBE,
+            ef_search=RAG_EF_SEARCH
+        )
+
+        # Verifica se o RAG inicializou corretamente
+        if not rag_system.is_ready():
+             logger.error('Erro: Sistema RAG não inicializado corretamente.')
+             rag_system = None # Define como None para indicar falha
+
+    except Exception as e:
+        logger.error('Ocorreu um erro durante a inicialização da IA ou do RAG: %s', e)
+        llm_backend = None
+        rag_system = None
+        logger.warning('Inicialização falhou.')
+
+else:
+     logger.error('Erro: Chave GOOGLE_API_KEY ou SECRET_KEY não encontrada. API Google AI e RAG NÃO serão configurados.')
+     llm_backend = None
+     rag_system = None
+
+
+# Usa o mesmo modelo de embedding do RAG, então só existe com o RAG pronto
+answer_cache = None
+if rag_system and ANSWER_CACHE_SIZE > 0:
+    answer_cache = SemanticAnswerCache(
+        dimension=rag_system.embedding_model.get_sentence_embedding_dimension(),
+        similarity_threshold=ANSWER_CACHE_THRESHOLD,
+        max_entries=ANSWER_CACHE_SIZE,
+        ttl_seconds=ANSWER_CACHE_TTL
+    )
+    logger.info('Cache semântico de respostas habilitado (até %s respostas, similaridade >= %s).', ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD)
+
+
+# Arquivos anexados e histórico de chat ficam no servidor; o cookie da sessão guarda apenas IDs
+document_store = DocumentStore(
+    db_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), DOCUMENT_STORE_PATH),
+    ttl_seconds=DOCUMENT_STORE_TTL
+)
+
+
+# OCR e extração de PDFs anexados rodam em um pool de processos, fora da thread da requisição.
+# O estado dos jobs fica no mesmo SQLite, visível para todos os workers
+upload_jobs = UploadJobManager(db_path=document_store.db_path, max_workers=UPLOAD_WORKERS)
+
+
+# --- Configuração do Flask ---
+app = Flask(__name__)
+if SECRET_KEY:
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+    app.permanent_session_lifetime = app.config['PERMANENT_SESSION_LIFETIME']
+    logger.info('Flask SECRET_KEY configurada. Sessões habilitadas com tempo de vida de %ss.', app.config['PERMANENT_SESSION_LIFETIME'])
+else:
+    logger.error('Erro: SECRET_KEY não encontrada nas variáveis de ambiente. Sessões NÃO habilitadas!')
+
+
+# --- Rotas da Aplicação Web ---
+
+@app.route('/')
+def index():
+    # Limpa o histórico de chat E o histórico de arquivo na sessão ao carregar a página principal
+    document_store.delete_chat_history(session.get('session_key'))
+    document_store.delete(session.pop('last_file_id', None)) # Descarta o último arquivo guardado no servidor
+    logger.debug('[/] Histórico da sessão (chat e arquivo) limpo ao carregar a página.')
+
+    # O status da IA agora depende se o modelo Gemini e o RAG inicializaram
+    ia_status = "ok" if llm_backend and (rag_system is None or rag_system.is_ready()) else "error"
+    # O RAG pode não estar pronto se não houver PDFs, mas a IA ainda pode responder perguntas gerais.
+    # Talvez o status deva ser "rag_error" ou "ai_error" para ser mais específico.
+    # Por enquanto, 'ok' se a IA estiver pronta, mesmo que o RAG falhe.
+    # Ajustando: Status é 'ok' se Gemini estiver pronto. Se RAG falhar, informamos no log.
+    ia_status = "ok" if llm_backend else "error"
+
+
+    chat_history = document_store.get_chat_history(session.get('session_key'))
+    return render_template('index.html', ia_status=ia_status, chat_history=chat_history)
+
+
+def _get_session_key() -> str:
+    """ID da sessão usado para guardar o histórico de chat no servidor (criado na primeira pergunta)."""
+    if 'session_key' not in session:
+        session['session_key'] = uuid.uuid4().hex
+    return session['session_key']
+
+
+def _document_chunk_embeddings(doc_id: str, chunks: list[str]) -> np.ndarray:
+    """
+    Embeddings dos chunks de um arquivo anexado, calculados uma vez por documento e guardados no DocumentStore.
+    Não passam pelo cache LRU de embeddings do RAG: um arquivo grande expulsaria dele as perguntas recentes.
+    """
+    embeddings = document_store.get_embeddings(doc_id)
+    if embeddings is None or embeddings.shape != (len(chunks), rag_system.embedding_model.get_sentence_embedding_dimension()):
+        with timed("embedding_encode"):
+            embeddings = rag_system.embed_texts(chunks)
+        document_store.put_embeddings(doc_id, embeddings)
+    return embeddings
+
+
+def _prepare_ask_turn(user_question: str | None, uploaded_file, file_job_id: str | None = None) -> dict:
+    """
+    Processa o arquivo anexado, busca o contexto (RAG e último arquivo) e monta o prompt de uma turno.
+    O arquivo pode vir no próprio /ask ou já ter sido enviado ao /upload (file_job_id).
+    Compartilhado por /ask e /ask_stream. Toda escrita no cookie da sessão acontece aqui, antes da resposta começar.
+    """
+    logger.debug("[/ask] Pergunta recebida: '%s'", user_question)
+    logger.debug('[/ask] Arquivo recebido (se houver): %s', uploaded_file.filename if uploaded_file else (f'job {file_job_id}' if file_job_id else 'Nenhum'))
+
+    # Recupera o conteúdo e nome do último arquivo processado na sessão (guardado no servidor), se existirem
+    last_file_id_from_session = session.get('last_file_id')
+    last_file_from_store = document_store.get(last_file_id_from_session)
+    last_file_content_from_session = last_file_from_store["content"] if last_file_from_store else ''
+    last_file_name_from_session = last_file_from_store["file_name"] if last_file_from_store else 'arquivo anterior'
+    logger.debug("[/ask] Conteúdo do último arquivo da sessão recuperado ('%s', tamanho: %s chars).", last_file_name_from_session, len(last_file_content_from_session))
+
+
+    # --- Processar Arquivo Anexado NESTA TURNO (se houver) ---
+    file_processing_result_current_turn = "" # Conteúdo do arquivo enviado NESTA turno
+    is_file_processed_ok_current_turn = False # Flag para saber se o processamento do arquivo NESTA turno foi bem sucedido
+
+    uploaded_file_name = None # Nome do arquivo anexado NESTA TURNO (enviado no /ask ou via /upload)
+    upload_job = None
+
+    if uploaded_file:
+        uploaded_file_name = uploaded_file.filename
+        logger.debug('[/ask] Tipo MIME do arquivo NESTA TURNO: %s', uploaded_file.content_type)
+
+        if uploaded_file.content_type.startswith('image/') or uploaded_file.content_type == 'application/pdf':
+            logger.debug('[/ask] Arquivo NESTA TURNO enviado ao pool de processamento (OCR/PDF)...')
+            job_id = upload_jobs.submit(uploaded_file.read(), uploaded_file.filename, uploaded_file.content_type)
+            with timed("upload_wait"):
+                upload_job = upload_jobs.wait(job_id, timeout=UPLOAD_PROCESSING_TIMEOUT)
+        else:
+            logger.warning('[/ask] Tipo de arquivo NESTA TURNO não suportado: %s', uploaded_file.content_type)
+            file_processing_result_current_turn = f"Tipo de arquivo anexado NESTA TURNO ({uploaded_file.filename}, Tipo: {uploaded_file.content_type}) não suportado para processamento no momento.\n"
+
+    elif file_job_id:
+        with timed("upload_wait"):
+            upload_job = upload_jobs.wait(file_job_id, timeout=UPLOAD_PROCESSING_TIMEOUT)
+        if upload_job:
+            uploaded_file_name = upload_job["file_name"]
+        else:
+            logger.warning('[/ask] Job de upload %s não encontrado (expirado ou de outro processo).', file_job_id)
+
+    if upload_job:
+        if upload_job["status"] == "done":
+            file_processing_result_current_turn = upload_job["result"]
+        elif upload_job["status"] == "error":
+            file_processing_result_current_turn = upload_job["error"]
+        else:
+            file_processing_result_current_turn = "Erro: o processamento do arquivo anexado excedeu o tempo limite."
+
+        if file_processing_result_current_turn and not file_processing_result_current_turn.startswith("Erro") and not file_processing_result_current_turn.startswith("A imagem não contém texto legível") and not file_processing_result_current_turn.startswith(NO_TEXT_PDF_MESSAGE):
+             is_file_processed_ok_current_turn = True
+             logger.debug('[/ask] Texto do arquivo NESTA TURNO extraído com sucesso.')
+        else:
+             logger.warning('[/ask] Falha ou sem texto detectado no processamento do arquivo NESTA TURNO.')
+
+    if uploaded_file_name:
+        # ** ATUALIZA o último arquivo da sessão APÓS processar o arquivo NESTA TURNO **
+        # Se o processamento NESTA TURNO foi OK, guarda o texto completo no servidor e só o ID NA SESSAO
+        if is_file_processed_ok_current_turn and file_processing_result_current_turn:
+             session['last_file_id'] = document_store.put(uploaded_file_name, file_processing_result_current_turn)
+             logger.debug('[/ask] Conteúdo e nome do arquivo NESTA TURNO (%s) salvos no servidor.', uploaded_file_name)
+        # Se o processamento NESTA TURNO falhou ou não teve arquivo, o conteúdo e nome do último arquivo na sessão NÃO mudam.
+
+
+    # --- Iniciar montagem do Contexto e Processamento ---
+    session_key = _get_session_key()
+    with timed("history_load"):
+        chat_history = document_store.get_chat_history(session_key)
+    logger.debug('[/ask] Histórico de CHAT da sessão recuperado (%s turns).', len(chat_history))
+
+    # Tokens por seção do prompt: (sem orçamento, com orçamento), para os logs
+    section_tokens = {}
+
+    history_turns = select_history(chat_history[-MAX_HISTORY_TURNS:], CONTEXT_TOKEN_BUDGETS["history"])
+    section_tokens["history"] = (sum(estimate_tokens(turn.get('user', '')) + estimate_tokens(turn.get('ai', '')) for turn in chat_history[-MAX_HISTORY_TURNS:]),
+                                 sum(estimate_tokens(turn.get('user', '')) + estimate_tokens(turn.get('ai', '')) for turn in history_turns))
+    formatted_history = ""
+    for turn in history_turns:
+        user_msg = turn.get('user', '')
+        ai_msg = turn.get('ai', '')
+        formatted_history += f"Usuário: {user_msg}\nAssistente: {ai_msg}\n---\n"
+    logger.debug('[/ask] Histórico de chat formatado.')
+
+
+    # ** LÓGICA: Busca Direta no Conteúdo do Último Arquivo da Sessão (se aplicável) **
+    file_search_summary = ""
+    # Só tenta buscar no arquivo anterior se houver conteúdo salvo E se houver uma pergunta de texto NESTA TURNO
+    if last_file_content_from_session and user_question:
+        logger.debug("[/ask] Tentando buscar '%s' ou termos relevantes no conteúdo do último arquivo da sessão ('%s')...", user_question, last_file_name_from_session)
+        # Busca no índice invertido construído no upload (texto completo, sem truncamento)
+        with timed("file_search"):
+            # O texto já foi lido do banco no início da turno; do índice só vêm as posições dos termos da pergunta
+            occurrences = document_store.search(last_file_id_from_session, user_question, snippet_size=150, content=last_file_content_from_session)
+
+        if occurrences:
+            logger.debug('[/ask] Encontrado %s ocorrência(s) no último arquivo da sessão.', len(occurrences))
+            file_search_summary = f"Resultado da busca por '{user_question}' no último arquivo da sessão ('{last_file_name_from_session}'): Encontrado {len(occurrences)} ocorrência(s).\nTrechos relevantes: " + "\n---\n".join(occurrences)
+        else:
+            logger.debug("[/ask] '%s' (ou termos relevantes) NÃO encontrado(s) no último arquivo da sessão.", user_question)
+            file_search_summary = f"Resultado da busca por '{user_question}' no último arquivo da sessão ('{last_file_name_from_session}'): Nenhuma ocorrência encontrada."
+    # else:
+        # print("[/ask] Não há conteúdo de arquivo anterior ou pergunta de texto para realizar busca direta.")
+
+    # Se um arquivo novo substituiu o anterior NESTA TURNO, o anterior não é mais necessário no servidor
+    if last_file_id_from_session and session.get('last_file_id') != last_file_id_from_session:
+        document_store.delete(last_file_id_from_session)
+
+
+    context_parts = []
+
+    # Adiciona o resultado da busca direta no arquivo anterior (se feita)
+    if file_search_summary:
+         context_parts.append("--- RESULTADO DA BUSCA NO ÚLTIMO ARQUIVO ANEXADO ---\n\n" + file_search_summary)
+         logger.debug('[/ask] Resultado da busca direta no arquivo anterior adicionado ao contexto.')
+
+
+    relevant_chunks_rag = []
+    used_kb_chunk_ids = []
+    question_embedding = None # Reaproveitado para escolher os trechos mais relevantes dos arquivos
+    if rag_system and rag_system.is_ready():
+        try:
+            # Prepara os embeddings usados para a busca RAG (para chunks da BASE DE CONHECIMENTO)
+            search_embeddings_parts = []
+            if user_question:
+                question_embedding = rag_system.embed_texts_cached([user_question])[0] # Perguntas repetidas vêm do cache LRU
+                search_embeddings_parts.append(question_embedding.reshape(1, -1))
+            # O arquivo ANEXADO NESTA TURNO é dividido com o mesmo chunker da base (o modelo de embedding trunca textos longos).
+            # Os embeddings dos chunks ficam guardados com o documento e são reaproveitados quando ele vira o arquivo anterior
+            if is_file_processed_ok_current_turn and file_processing_result_current_turn:
+                search_embeddings_parts.append(_document_chunk_embeddings(session['last_file_id'], rag_system.chunk_text(file_processing_result_current_turn)))
+            # Não usamos o last_file_content_from_session para a busca RAG na base KB, focamos na busca direta nele.
+
+            if search_embeddings_parts:
+                 search_embeddings_rag = np.vstack(search_embeddings_parts)
+                 logger.debug('[/ask] Realizando busca RAG na BASE DE CONHECIMENTO a partir de %s textos (Pergunta/chunks do ArquivoAtual)...', len(search_embeddings_rag))
+                 # Uma única busca FAISS para todos os textos
+                 ranked = rag_system.search_chunks_ranked(search_embeddings_rag, TOP_K_CHUNKS)
+                 logger.debug('[/ask] IDs relevantes combinados (únicos, por score) da busca RAG: %s', [chunk_id for chunk_id, _ in ranked])
+
+                 # Rerank MMR (relevância x diversidade entre chunks e documentos de origem) dos melhores candidatos
+                 with timed("mmr_rerank"):
+                      candidates = ranked[:MMR_CANDIDATES]
+                      candidate_ids = [chunk_id for chunk_id, _ in candidates]
+                      # Direto do dicionário: get_chunks_by_ids pula IDs sem texto, e um zip desalinharia IDs e textos
+                      chunk_texts = {chunk_id: rag_system.text_chunks[chunk_id] for chunk_id in candidate_ids if chunk_id in rag_system.text_chunks}
+                      candidates = [(chunk_id, score) for chunk_id, score in candidates if chunk_id in chunk_texts]
+                      candidate_ids = [chunk_id for chunk_id, _ in candidates]
+                      chunk_documents = rag_system.get_chunk_documents(candidate_ids)
+                      candidate_embeddings = rag_system.get_chunk_embeddings(candidate_ids) # Vetores já guardados no índice
+                      mmr_ids = mmr_rank(candidate_ids, dict(candidates), candidate_embeddings, chunk_documents, lambda_=MMR_LAMBDA)
+
+                 # Chunks vizinhos viram um único trecho (sem repetir o CHUNK_OVERLAP), dentro do orçamento de tokens
+                 with timed("context_budget"):
+                      used_kb_chunk_ids, relevant_chunks_rag = fill_chunk_budget(
+                           mmr_ids, chunk_texts, chunk_documents, rag_system.chunk_overlap,
+                           max_tokens=CONTEXT_TOKEN_BUDGETS["kb"], max_chunks=COMBINED_TOP_K_CHUNKS
+                      )
+                 section_tokens["kb"] = (sum(estimate_tokens(chunk_texts[chunk_id]) for chunk_id in candidate_ids[:COMBINED_TOP_K_CHUNKS]),
+                                         sum(estimate_tokens(text) for text in relevant_chunks_rag))
+                 logger.debug('[/ask] Chunks escolhidos após MMR e orçamento: %s (%s trecho(s)).', used_kb_chunk_ids, len(relevant_chunks_rag))
+
+
+            if relevant_chunks_rag:
+                 context_parts.append("--- CONTEXTO RELEVANTE DA BASE DE CONHECIMENTO (RAG) ---\n\n" + "\n---\n".join(relevant_chunks_rag))
+                 logger.debug('[/ask] Contexto RAG da BASE DE CONHECIMENTO adicionado.')
+            else:
+                 logger.debug('[/ask] Nenhum contexto relevante encontrado na busca RAG na BASE DE CONHECIMENTO.')
+
+
+        except Exception as e:
+             logger.error('[/ask] Ocorreu um erro durante a busca RAG na BASE DE CONHECIMENTO: %s', e)
+             context_parts.append("--- ERRO NA BUSCA RAG --- Ocorreu um erro ao buscar informações na base de conhecimento.")
+    else:
+         logger.warning('[/ask] Sistema RAG não inicializado ou pronto. Pulando busca RAG.')
+         context_parts.append("--- RAG INDISPONÍVEL --- O sistema de busca na base de conhecimento não está disponível.")
+
+
+    # Adiciona o conteúdo do arquivo ANEXADO NESTA TURNO (se processado OK)
+    if is_file_processed_ok_current_turn and file_processing_result_current_turn:
+        with timed("file_passages"):
+            current_file_context = select_passages(file_processing_result_current_turn, CONTEXT_TOKEN_BUDGETS["current_file"], rag_system, question_embedding,
+                                                   embed_chunks=lambda chunks: _document_chunk_embeddings(session['last_file_id'], chunks))
+        section_tokens["current_file"] = (estimate_tokens(file_processing_result_current_turn), estimate_tokens(current_file_context))
+        if current_file_context == file_processing_result_current_turn:
+             context_parts.append("--- CONTEÚDO DO ARQUIVO ANEXADO NESTA TURNO ---\n\n" + current_file_context)
+        else:
+             context_parts.append("--- TRECHOS DO ARQUIVO ANEXADO NESTA TURNO (os mais relevantes para a pergunta; '[...]' indica partes omitidas) ---\n\n" + current_file_context)
+        logger.debug('[/ask] Conteúdo do arquivo NESTA TURNO adicionado ao contexto.')
+    # else: # Se não teve arquivo NESTA TURNO ou falhou, não adiciona esta seção.
+
+
+    # Adiciona o conteúdo do ÚLTIMO ARQUIVO da sessão: inteiro se couber no orçamento, senão os trechos mais relevantes para a pergunta
+    # Isso serve como uma referência para a IA, além do resultado da busca direta.
+    # Só adicionamos se houver conteúdo e se nenhum arquivo novo foi processado NESTA TURNO (ele já substituiu o anterior)
+    if last_file_content_from_session:
+         is_replaced_by_current_file = bool(uploaded_file_name and is_file_processed_ok_current_turn)
+         if not is_replaced_by_current_file:
+              with timed("file_passages"):
+                   previous_file_context = select_passages(last_file_content_from_session, CONTEXT_TOKEN_BUDGETS["previous_file"], rag_system, question_embedding,
+                                                           embed_chunks=lambda chunks: _document_chunk_embeddings(last_file_id_from_session, chunks))
+              section_tokens["previous_file"] = (estimate_tokens(last_file_content_from_session), estimate_tokens(previous_file_context))
+              if previous_file_context == last_file_content_from_session:
+                   context_parts.append(f"--- CONTEÚDO DO ÚLTIMO ARQUIVO DA SESSÃO ('{last_file_name_from_session}') ---\n\n" + previous_file_context)
+              else:
+                   context_parts.append(f"--- TRECHOS DO ÚLTIMO ARQUIVO DA SESSÃO ('{last_file_name_from_session}') (os mais relevantes para a pergunta; '[...]' indica partes omitidas) ---\n\n" + previous_file_context)
+              logger.debug('[/ask] Conteúdo do último arquivo da sessão (inteiro ou trechos selecionados pela pergunta) adicionado ao contexto.')
+         # else:
+              # print("[/ask] Conteúdo do último arquivo da sessão não adicionado ao contexto, pois arquivo foi re-anexado e processado nesta turno.")
+
+
+    context_for_gemini = "\n\n".join(context_parts)
+
+    if not context_for_gemini.strip():
+         logger.warning('[/ask] Contexto final para Gemini está vazio.')
+         context_for_gemini = "Nenhum contexto relevante ou informação de arquivo disponível."
+    else:
+         logger.debug('[/ask] Contexto final para Gemini montado.')
+
+
+    # Prompt final enviado para o Gemini
+    # Ajuste a "Pergunta do usuário" no prompt caso seja apenas envio de arquivo ou se a pergunta é sobre o arquivo anterior
+    final_user_query_in_prompt = user_question if user_question else (f"Analise o conteúdo do último arquivo da sessão ('{last_file_name_from_session}') e o contexto fornecido para me dizer sobre o que se trata ou o que você encontrou de relevante." if last_file_content_from_session else "Por favor, forneça mais informações ou anexe um arquivo.")
+
+
+    prompt_with_rag_context = f"""
+Você é um assistente especializado em simplificar processos burocráticos e legais para leigos no Brasil.
+Você está participando de uma conversa com um usuário.
+
+Histórico da Conversa (últimas {MAX_HISTORY_TURNS} turns):
+---
+{formatted_history if formatted_history else "Nenhum histórico anterior."}
+---
+
+Considere o seguinte CONTEXTO RELEVANTE para fundamentar sua resposta:
+{context_for_gemini}
+
+Utilize também seu conhecimento geral para complementar a resposta ou para responder a perguntas que não são totalmente cobertas pelo contexto fornecido.
+SEMPRE forneça uma resposta direta e útil. Baseie-se no contexto fornecido e no seu conhecimento para responder à pergunta do usuário. **Se o contexto incluir um '--- RESULTADO DA BUSCA NO ÚLTIMO ARQUIVO ANEXADO ---', utilize esta informação diretamente para responder a perguntas sobre o conteúdo específico do arquivo anterior (como buscar nomes ou termos).** Se o resultado da busca for 'Nenhuma ocorrência encontrada', diga isso ao usuário de forma clara.
+
+Pergunta do usuário: {final_user_query_in_prompt}
+"""
+    logger.debug('[/ask] Prompt final montado.')
+    sections_log = ", ".join(f"{section} {before}->{after}" for section, (before, after) in section_tokens.items())
+    logger.info('[/ask] Tokens estimados por seção (sem orçamento -> com orçamento): %s. Prompt final: ~%s tokens.', sections_log, estimate_tokens(prompt_with_rag_context))
+    # print(f"Prompt completo enviado para Gemini: {prompt_with_rag_context}") # Log opcional do prompt completo
+
+
+    # Verifica se há contexto relevante ou pergunta antes de chamar a IA
+    # Agora pode chamar a IA mesmo que só tenha contexto de arquivo anterior ou resultado de busca direta
+    # Só não chama se não tiver PERGUNTA E não tiver NADA de contexto (nem RAG, nem arquivo atual, nem arquivo anterior/busca)
+    immediate_response = None
+    if not user_question and not context_for_gemini.strip() and not (uploaded_file_name and file_processing_result_current_turn):
+         logger.debug('[/ask] Sem entrada (pergunta/arquivo) e sem contexto relevante/arquivo anterior. Não chamando a IA.')
+         immediate_response = "Desculpe, não recebi uma pergunta de texto, arquivo anexado ou contexto relevante para processar."
+    elif not llm_backend:
+        logger.warning('[/ask] Backend de IA não inicializado.')
+        immediate_response = "Desculpe, o serviço de IA não está disponível no momento. Verifique a inicialização."
+
+    # O cache de respostas só vale para perguntas de texto cujo contexto é apenas a base (nenhum arquivo, atual ou anterior)
+    answer_cache_key = None
+    if answer_cache and immediate_response is None and user_question and question_embedding is not None and not uploaded_file_name and not last_file_content_from_session:
+        # O histórico enviado no prompt faz parte da chave: a mesma pergunta em conversas diferentes tem respostas diferentes
+        history_key = hashlib.sha256(json.dumps(history_turns, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+        answer_cache_key = (question_embedding, [int(chunk_id) for chunk_id in used_kb_chunk_ids], history_key)
+
+    return {
+        "prompt": prompt_with_rag_context,
+        "immediate_response": immediate_response, # Resposta pronta, sem chamar a IA
+        "session_key": session_key,
+        "chat_history": chat_history,
+        "answer_cache_key": answer_cache_key, # (embedding da pergunta, IDs dos chunks da base, hash do histórico) ou None
+        "user_hist_display": user_question if user_question else (f"Anexado: {uploaded_file_name}" if uploaded_file_name else "Sem entrada"), # Simplifica a exibição do histórico
+        "metadata": {
+            "kb_chunk_ids": [int(chunk_id) for chunk_id in used_kb_chunk_ids],
+            "current_file_name": uploaded_file_name if is_file_processed_ok_current_turn else None,
+            "last_file_name": last_file_name_from_session if last_file_content_from_session else None,
+            "file_search_performed": bool(file_search_summary),
+            "cached": False, # Preenchido pelo /ask_stream antes de enviar os metadados
+        },
+    }
+
+
+def _describe_llm_error(e: Exception) -> str:
+    logger.error('[/ask] Ocorreu um erro ao chamar a API de IA: %s', e)
+    if hasattr(e, 'response'):
+         logger.debug('[/ask] Detalhes da Resposta da API: %s', e.response)
+    error_message = "Ocorreu um erro ao gerar a resposta da IA."
+    if isinstance(e, (LLMResponseInterrupted, LLMEmptyResponse)):
+         error_message = str(e)
+    if hasattr(e, 'response') and hasattr(e.response, 'text'):
+         try:
+              # Tenta extrair mensagem de erro da API se disponível
+              api_error_details = e.response.json()
+              if "message" in api_error_details:
+                   error_message = f"Erro da API: {api_error_details['message']}"
+              elif "error" in api_error_details and "message" in api_error_details["error"]:
+                    error_message = f"Erro da API: {api_error_details['error']['message']}"
+         except:
+               pass
+    return error_message
+
+
+def _save_chat_turn(turn: dict, resposta_texto: str):
+    # Grava no servidor (e não no cookie), pois no streaming a resposta termina depois que os headers já foram enviados
+    chat_history = turn["chat_history"] + [{'user': turn["user_hist_display"], 'ai': resposta_texto}]
+    with timed("history_save"):
+        document_store.save_chat_history(turn["session_key"], chat_history[-MAX_HISTORY_TURNS:])
+    logger.debug('[/ask] Histórico de CHAT da sessão atualizado. Tamanho atual: %s turns.', len(chat_history[-MAX_HISTORY_TURNS:]))
+
+
+def _get_cached_answer(turn: dict) -> str | None:
+    if turn["answer_cache_key"] is None:
+        return None
+    question_embedding, chunk_ids, history_key = turn["answer_cache_key"]
+    with timed("answer_cache_lookup"):
+        cached_answer = answer_cache.lookup(question_embedding, chunk_ids, history_key, rag_system.index_version)
+    if cached_answer is not None:
+        logger.debug('[/ask] Resposta reaproveitada do cache semântico (sem chamar a IA).')
+    return cached_answer
+
+
+def _store_answer(turn: dict, resposta_texto: str):
+    if turn["answer_cache_key"] is not None:
+        question_embedding, chunk_ids, history_key = turn["answer_cache_key"]
+        answer_cache.store(question_embedding, chunk_ids, history_key, resposta_texto, rag_system.index_version)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/ask', methods=['POST'])
+def ask_ia():
+    start_time = time.perf_counter()
+    with timed("prepare_turn"):
+        turn = _prepare_ask_turn(request.form.get('user_input'), request.files.get('file'), request.form.get('file_job_id'))
+
+    cached_answer = _get_cached_answer(turn)
+    if turn["immediate_response"] is not None:
+        resposta_texto = turn["immediate_response"]
+    elif cached_answer is not None:
+        resposta_texto = cached_answer
+    else:
+        try:
+            with timed("llm_generate"):
+                resposta_texto = llm_backend.generate(turn["prompt"])
+            _store_answer(turn, resposta_texto)
+            logger.debug('[/ask] Resposta da IA pronta para envio.')
+        except Exception as e:
+            resposta_texto = _describe_llm_error(e) # Define a resposta como a mensagem de erro
+
+    _save_chat_turn(turn, resposta_texto)
+    stage_metrics.observe("ask_total", time.perf_counter() - start_time)
+    return jsonify({"response": resposta_texto})
+
+
+@app.route('/ask_stream', methods=['POST'])
+def ask_ia_stream():
+    """
+    Mesma entrada do /ask, com a resposta enviada por Server-Sent Events, nesta ordem:
+      metadata -> dados da recuperação (chunks da base, arquivos usados, se a resposta veio do cache), antes de chamar a IA
+      token    -> {"text": ...} a cada pedaço da resposta da IA
+      error    -> {"message": ...} se a IA falhar (antes ou no meio da resposta) ou não gerar texto
+      done     -> {"response": resposta completa}; o histórico da sessão é gravado neste momento
+    Se o cliente desconectar, a geração é interrompida e a turno não entra no histórico.
+    """
+    start_time = time.perf_counter()
+    with timed("prepare_turn"):
+        turn = _prepare_ask_turn(request.form.get('user_input'), request.files.get('file'), request.form.get('file_job_id'))
+
+    cached_answer = _get_cached_answer(turn)
+    turn["metadata"]["cached"] = cached_answer is not None
+
+    def stream_events():
+        yield _sse_event("metadata", turn["metadata"])
+
+        # Resposta pronta (sem chamar a IA) vai em um único token
+        ready_response = turn["immediate_response"] if turn["immediate_response"] is not None else cached_answer
+        if ready_response is not None:
+            yield _sse_event("token", {"text": ready_response})
+            _save_chat_turn(turn, ready_response)
+            yield _sse_event("done", {"response": ready_response})
+            return
+
+        response_parts = []
+        llm_start_time = time.perf_counter()
+        llm_stream = llm_backend.stream(turn["prompt"])
+        try:
+            for piece in llm_stream:
+                if not response_parts:
+                    stage_metrics.observe("llm_first_token", time.perf_counter() - llm_start_time)
+                response_parts.append(piece)
+                yield _sse_event("token", {"text": piece})
+            stage_metrics.observe("llm_stream", time.perf_counter() - llm_start_time)
+            _store_answer(turn, "".join(response_parts))
+        except GeneratorExit:
+            logger.info('[/ask_stream] Cliente desconectou. Geração da IA interrompida; turno não salva no histórico.')
+            raise
+        except Exception as e:
+            error_message = _describe_llm_error(e)
+            response_parts = [error_message]
+            yield _sse_event("error", {"message": error_message})
+        finally:
+            llm_stream.close()
+
+        resposta_texto = "".join(response_parts)
+        _save_chat_turn(turn, resposta_texto)
+        logger.debug('[/ask_stream] Resposta da IA enviada por completo.')
+        yield _sse_event("done", {"response": resposta_texto})
+
+    def generate_events():
+        # Registrado em toda saída (resposta pronta, cache, IA, erro ou desconexão), para não distorcer os percentis
+        try:
+            yield from stream_events()
+        finally:
+            stage_metrics.observe("ask_stream_total", time.perf_counter() - start_time)
+
+    # X-Accel-Buffering desliga o buffer de proxies (ex: nginx), que atrasaria os eventos
+    return Response(generate_events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Envia um arquivo para processamento em segundo plano. O job_id retornado pode ser usado no /ask (campo file_job_id)."""
+    uploaded_file = request.files.get('file')
+    if not uploaded_file:
+        return jsonify({"status": "error", "message": "Nenhum arquivo enviado."}), 400
+    if not (uploaded_file.content_type.startswith('image/') or uploaded_file.content_type == 'application/pdf'):
+        return jsonify({"status": "error", "message": f"Tipo de arquivo não suportado: {uploaded_file.content_type}"}), 415
+
+    job_id = upload_jobs.submit(uploaded_file.read(), uploaded_file.filename, uploaded_file.content_type)
+    logger.debug("[/upload] Arquivo '%s' enviado ao pool de processamento. Job: %s", uploaded_file.filename, job_id)
+    return jsonify(upload_jobs.status(job_id)), 202
+
+
+@app.route('/upload/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Estado do job (queued, running, done ou error) e, quando concluído, o texto extraído."""
+    job = upload_jobs.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job não encontrado ou expirado."}), 404
+    return jsonify(job)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Histogramas de latência por etapa (upload, busca, embedding, FAISS, montagem do contexto, IA) e contadores do cache de respostas, no formato do Prometheus."""
+    metrics_text = stage_metrics.render_prometheus()
+    if answer_cache:
+        metrics_text += answer_cache.render_prometheus()
+    return Response(metrics_text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/clear_history', methods=['POST'])
+def clear_history():
+    # Limpa o histórico de chat E o histórico de arquivo na sessão
+    document_store.delete_chat_history(session.get('session_key'))
+    document_store.delete(session.pop('last_file_id', None)) # Descarta o último arquivo guardado no servidor
+    logger.debug('[/clear_history] Histórico da sessão (chat e arquivo) limpo.')
+    return jsonify({"status": "success", "message": "Histórico da conversa limpo."})
+
+if __name__ == '__main__':
+    logger.info('Iniciando o servidor Flask...')
+    app.run(debug=True)
\ No newline at end of file
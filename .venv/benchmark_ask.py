@@ -0,0 +1,232 @@
+"""
+Benchmark de ponta a ponta do /ask (ou /ask_stream), sem rede: base de conhecimento e anexos sintéticos
+e o backend de IA fake (llm_backends.FakeLLMBackend) com latência configurável no lugar do Gemini.
+
+Uso:
+    python benchmark_ask.py
+    python benchmark_ask.py --requests 500 --concurrency 16 --upload-ratio 0.3 --stream
+    python benchmark_ask.py --first-token-ms 800 --token-ms 20 --image-uploads
+    python benchmark_ask.py --answer-cache
+
+Informa vazão, latência total p50/p95/p99 e p50/p95/p99 de cada etapa (as mesmas expostas em /metrics).
+As perguntas se repetem, então o cache semântico de respostas fica desligado por padrão (senão a medição seria
+quase só de acertos no cache); com --answer-cache ele é ligado e os acertos/erros são informados à parte.
+Tudo roda em um diretório temporário (base, cache do RAG e banco de documentos); os dados reais não são tocados.
+O modelo de embedding precisa já estar no cache local do sentence-transformers (HF_HUB_OFFLINE=1).
+Com --image-uploads os anexos incluem imagens PNG (Pillow e Tesseract instalados).
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Frases por tema; a base sintética e as perguntas usam o mesmo vocabulário para que a busca encontre algo
+TOPICS = {
+    "férias": [
+        "O empregado tem direito a trinta dias de férias após cada período aquisitivo de doze meses de trabalho.",
+        "As férias podem ser divididas em até três períodos, um deles com pelo menos catorze dias corridos.",
+        "O pagamento das férias deve ser feito até dois dias antes do início, com o acréscimo de um terço.",
+    ],
+    "rescisão": [
+        "Na rescisão sem justa causa o trabalhador recebe aviso prévio, saldo de salário e multa de quarenta por cento do FGTS.",
+        "O prazo para pagamento das verbas rescisórias é de dez dias contados do término do contrato.",
+        "Na rescisão por justa causa o empregado perde o direito ao aviso prévio e às férias proporcionais.",
+    ],
+    "multa de trânsito": [
+        "Dirigir sem habilitação é infração gravíssima, com multa multiplicada e retenção do veículo.",
+        "O condutor pode apresentar defesa prévia contra a multa no prazo indicado na notificação da autuação.",
+        "Exceder a velocidade máxima em mais de cinquenta por cento gera suspensão do direito de dirigir.",
+    ],
+    "consumidor": [
+        "O fornecedor tem trinta dias para sanar o vício do produto durável antes da troca ou devolução do valor.",
+        "Nas compras fora do estabelecimento o consumidor pode desistir em sete dias a contar do recebimento.",
+        "A cobrança indevida dá direito à devolução em dobro do valor pago em excesso, com correção.",
+    ],
+    "pensão alimentícia": [
+        "A pensão alimentícia é fixada conforme a necessidade de quem recebe e a possibilidade de quem paga.",
+        "O atraso no pagamento da pensão alimentícia pode levar à prisão civil do devedor por até três meses.",
+        "A revisão da pensão pode ser pedida quando muda a situação financeira de uma das partes.",
+    ],
+}
+QUESTION_TEMPLATES = [
+    "Como funciona {topic}?",
+    "Quais são meus direitos sobre {topic}?",
+    "Qual o prazo relacionado a {topic}?",
+    "O que a lei diz sobre {topic}?",
+]
+
+
+# --- Corpus sintético ---
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages: list[list[str]]) -> bytes:
+    """PDF mínimo com camada de texto (Helvetica, WinAnsi), uma lista de linhas por página."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_refs = []
+    for lines in pages:
+        content = "BT /F1 11 Tf 14 TL 50 790 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        content_bytes = content.encode("cp1252", errors="replace")
+        objects.append(f"<< /Length {len(content_bytes)} >>\nstream\n" + content_bytes.decode("latin-1") + "\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref_offset = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+
+def build_image(lines: list[str]) -> bytes:
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (1200, 40 * len(lines) + 40), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((20, 20 + 40 * i), line, fill="black")
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def synthetic_pages(rng: random.Random, num_pages: int, lines_per_page: int = 40) -> list[list[str]]:
+    sentences = [sentence for topic_sentences in TOPICS.values() for sentence in topic_sentences]
+    return [[rng.choice(sentences)[:90] for _ in range(lines_per_page)] for _ in range(num_pages)]
+
+
+def build_corpus(root: str, rng: random.Random, kb_docs: int, pages_per_doc: int, image_uploads: bool) -> list[tuple[bytes, str, str]]:
+    """Grava os PDFs da base em root/knowledge_base e retorna os anexos [(bytes, nome, tipo MIME)]."""
+    kb_directory = os.path.join(root, "knowledge_base")
+    os.makedirs(kb_directory, exist_ok=True)
+    for i in range(kb_docs):
+        with open(os.path.join(kb_directory, f"documento_{i:03d}.pdf"), "wb") as f:
+            f.write(build_pdf(synthetic_pages(rng, pages_per_doc)))
+
+    uploads = [(build_pdf(synthetic_pages(rng, rng.randint(1, 4))), f"anexo_{i}.pdf", "application/pdf") for i in range(8)]
+    if image_uploads:
+        uploads += [(build_image(synthetic_pages(rng, 1, lines_per_page=12)[0]), f"foto_{i}.png", "image/png") for i in range(4)]
+    return uploads
+
+
+# --- Carga ---
+
+def run_client(app_module, stream: bool, jobs: list, uploads: list, latencies: list, errors: list, lock: threading.Lock):
+    client = app_module.app.test_client() # Um cliente (e uma sessão) por thread, como usuários diferentes
+    endpoint = '/ask_stream' if stream else '/ask'
+    while True:
+        with lock:
+            if not jobs:
+                return
+            question, upload_index = jobs.pop()
+        data = {'user_input': question}
+        if upload_index is not None:
+            file_bytes, file_name, content_type = uploads[upload_index]
+            data['file'] = (io.BytesIO(file_bytes), file_name, content_type)
+
+        start_time = time.perf_counter()
+        response = client.post(endpoint, data=data, content_type='multipart/form-data')
+        response.get_data() # Consome o stream inteiro no /ask_stream
+        elapsed = time.perf_counter() - start_time
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+
+def run_load(app_module, stream: bool, num_requests: int, concurrency: int, upload_ratio: float, uploads: list, rng: random.Random) -> tuple[float, list, list]:
+    jobs = []
+    for _ in range(num_requests):
+        question = rng.choice(QUESTION_TEMPLATES).format(topic=rng.choice(list(TOPICS)))
+        jobs.append((question, rng.randrange(len(uploads)) if uploads and rng.random() < upload_ratio else None))
+
+    latencies, errors, lock = [], [], threading.Lock()
+    threads = [threading.Thread(target=run_client, args=(app_module, stream, jobs, uploads, latencies, errors, lock)) for _ in range(concurrency)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start_time, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do /ask com corpus sintético e IA fake (sem rede).")
+    parser.add_argument("--requests", type=int, default=200, help="Total de requisições medidas.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clientes simultâneos.")
+    parser.add_argument("--upload-ratio", type=float, default=0.2, help="Fração das requisições com arquivo anexado.")
+    parser.add_argument("--kb-docs", type=int, default=20, help="PDFs na base de conhecimento sintética.")
+    parser.add_argument("--pages-per-doc", type=int, default=5, help="Páginas por PDF da base.")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Latência simulada até o primeiro token da IA.")
+    parser.add_argument("--token-ms", type=float, default=5, help="Latência simulada entre tokens da IA.")
+    parser.add_argument("--stream", action="store_true", help="Usa o /ask_stream no lugar do /ask.")
+    parser.add_argument("--answer-cache", action="store_true", help="Liga o cache semântico de respostas (desligado por padrão).")
+    parser.add_argument("--image-uploads", action="store_true", help="Inclui imagens (OCR) entre os anexos.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    root = tempfile.mkdtemp(prefix="harvey_bench_")
+    try:
+        uploads = build_corpus(root, rng, args.kb_docs, args.pages_per_doc, args.image_uploads)
+
+        # O app lê a configuração do ambiente na importação
+        os.environ.update({
+            "LLM_BACKEND": "fake",
+            "SECRET_KEY": os.getenv("SECRET_KEY", "benchmark"),
+            "HF_HUB_OFFLINE": "1",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+            "KB_DIRECTORY": os.path.join(root, "knowledge_base"),
+            "RAG_CACHE_DIRECTORY": os.path.join(root, "rag_cache"),
+            "DOCUMENT_STORE_PATH": os.path.join(root, "session_documents.sqlite3"),
+            "ANSWER_CACHE_SIZE": os.getenv("ANSWER_CACHE_SIZE", "1024") if args.answer_cache else "0",
+        })
+        import app as app_module
+        from llm_backends import FakeLLMBackend
+        from metrics import stage_metrics
+
+        if app_module.rag_system is None:
+            print("AVISO: RAG não inicializado (modelo de embedding fora do cache local?). Medindo sem a busca na base.")
+        app_module.llm_backend = FakeLLMBackend(token_delay=args.token_ms / 1000, first_token_delay=args.first_token_ms / 1000)
+
+        # Aquecimento (modelo, pools de processos, SQLite), fora da medição
+        run_load(app_module, args.stream, args.concurrency, args.concurrency, args.upload_ratio, uploads, rng)
+        stage_metrics.reset()
+        answer_cache_baseline = app_module.answer_cache.stats() if app_module.answer_cache else None
+
+        wall_time, latencies, errors = run_load(app_module, args.stream, args.requests, args.concurrency, args.upload_ratio, uploads, rng)
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+
+        print(f"\n=== Benchmark {'/ask_stream' if args.stream else '/ask'} ({args.requests} requisições, {args.concurrency} clientes) ===")
+        print(f"Vazão: {len(latencies) / wall_time:.1f} req/s   Erros: {len(errors)}")
+        if answer_cache_baseline is not None:
+            answer_cache_stats = app_module.answer_cache.stats()
+            hits = answer_cache_stats["hits"] - answer_cache_baseline["hits"]
+            misses = answer_cache_stats["misses"] - answer_cache_baseline["misses"]
+            print(f"Cache de respostas: {hits} acerto(s), {misses} erro(s) ({hits / max(1, hits + misses):.0%} das perguntas elegíveis sem chamar a IA)")
+        print(f"Latência total (ms): p50 {p50:8.1f}   p95 {p95:8.1f}   p99 {p99:8.1f}")
+        print(f"\n{'etapa':<20} {'n':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+        for stage, summary in sorted(stage_metrics.quantiles().items()):
+            print(f"{stage:<20} {summary['count']:>6} {summary['p50'] * 1000:>10.2f} {summary['p95'] * 1000:>10.2f} {summary['p99'] * 1000:>10.2f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
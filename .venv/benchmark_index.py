@@ -0,0 +1,140 @@
+"""
+Compara os backends de índice do RAG (index_backends.py) sobre a base de conhecimento real.
+
+Para cada backend informa: tempo de construção, memória do índice, latência de busca p50/p99
+(uma consulta por vez, como no /ask) e recall@k em relação à busca exata (flat).
+
+Uso:
+    python benchmark_index.py
+    python benchmark_index.py --backends flat hnsw ivf_pq --k 5 --nprobe 8 32 --ef-search 32 128
+
+Os vetores vêm de uma cópia temporária do cache do RAG (rag_cache/): se o cache foi construído com o backend flat,
+é reaproveitado; senão a base é indexada de novo na cópia. O cache usado pelo app nunca é alterado.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+import index_backends
+from rag import RAGSystem
+
+KB_DIRECTORY = "knowledge_base"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+RAG_CACHE_DIRECTORY = "rag_cache"
+
+# Perguntas típicas dos usuários, somadas às consultas sintéticas tiradas dos próprios chunks
+SAMPLE_QUESTIONS = [
+    "Quantos dias de férias o trabalhador tem direito?",
+    "Como funciona a rescisão do contrato de trabalho sem justa causa?",
+    "Qual a multa por dirigir sem habilitação?",
+    "Quais são os direitos do consumidor em caso de produto com defeito?",
+    "Qual o prazo para contestação no processo civil?",
+    "O que é pensão alimentícia e quem deve pagar?",
+    "Quais os direitos da pessoa idosa no transporte coletivo?",
+    "Qual a pena para o crime de furto?",
+    "Como funciona a guarda compartilhada dos filhos?",
+    "O que acontece se eu receber uma multa de trânsito por excesso de velocidade?",
+]
+
+
+def build_backend_index(backend: str, ids: np.ndarray, vectors: np.ndarray) -> tuple[faiss.Index, float]:
+    start_time = time.perf_counter()
+    index = index_backends.build_index(backend, vectors.shape[1], num_training_vectors=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, ids)
+    return index, time.perf_counter() - start_time
+
+
+def measure_search(index: faiss.Index, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Busca uma consulta por vez e retorna (ids encontrados, latências em ms)."""
+    found_ids = np.empty((len(queries), k), dtype='int64')
+    latencies_ms = np.empty(len(queries))
+    for i in range(len(queries)):
+        start_time = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies_ms[i] = (time.perf_counter() - start_time) * 1000
+        found_ids[i] = ids[0]
+    return found_ids, latencies_ms
+
+
+def recall_at_k(found_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    hits = [len(set(found[found != -1]) & set(exact[exact != -1])) / max(1, (exact != -1).sum())
+            for found, exact in zip(found_ids, exact_ids)]
+    return float(np.mean(hits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latência, memória e recall dos backends de índice do RAG.")
+    parser.add_argument("--backends", nargs="+", default=list(index_backends.INDEX_BACKENDS), choices=index_backends.INDEX_BACKENDS)
+    parser.add_argument("--k", type=int, default=5, help="Vizinhos por busca (recall@k).")
+    parser.add_argument("--num-queries", type=int, default=500, help="Consultas sintéticas (trechos de chunks da base).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[index_backends.DEFAULT_NPROBE], help="Valores de nprobe testados nos backends IVF.")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[index_backends.DEFAULT_EF_SEARCH], help="Valores de efSearch testados no HNSW.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # O RAGSystem salva o cache ao reindexar; trabalhar numa cópia evita sobrescrever o cache do app (ex: com outro backend)
+    cache_directory = tempfile.mkdtemp(prefix="rag_cache_bench_")
+    try:
+        source_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), RAG_CACHE_DIRECTORY)
+        if os.path.isdir(source_cache):
+            shutil.copytree(source_cache, cache_directory, dirs_exist_ok=True)
+        run_benchmark(args, cache_directory)
+    finally:
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+
+def run_benchmark(args: argparse.Namespace, cache_directory: str):
+    rag_system = RAGSystem(
+        kb_directory=KB_DIRECTORY,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        cache_directory=cache_directory,
+        index_backend="flat"
+    )
+    if not rag_system.is_ready():
+        raise SystemExit("RAG não inicializado: verifique o diretório knowledge_base/.")
+
+    ids, vectors = index_backends.index_vectors(rag_system.faiss_index)
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    print(f"\nBase: {len(ids)} vetores de dimensão {vectors.shape[1]}.")
+
+    # Consultas: perguntas de exemplo + a segunda metade de chunks sorteados (parecida, mas não idêntica, a um chunk indexado)
+    rng = np.random.default_rng(args.seed)
+    sampled_ids = rng.choice(ids, size=min(args.num_queries, len(ids)), replace=False)
+    chunk_queries = [rag_system.text_chunks[int(chunk_id)][CHUNK_SIZE // 2:] or rag_system.text_chunks[int(chunk_id)] for chunk_id in sampled_ids]
+    queries = rag_system.embed_texts(SAMPLE_QUESTIONS + chunk_queries)
+
+    exact_index, _ = build_backend_index("flat", ids, vectors)
+    exact_ids, _ = measure_search(exact_index, queries, args.k)
+
+    print(f"\n{'backend':<22} {'build (s)':>10} {'RAM (MB)':>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {f'recall@{args.k}':>10}")
+    for backend in args.backends:
+        index, build_time = build_backend_index(backend, ids, vectors)
+        size_mb = index_backends.index_size_bytes(index) / (1024 * 1024)
+
+        if backend == "hnsw":
+            search_settings = [(f"hnsw ef={ef}", {"ef_search": ef}) for ef in args.ef_search]
+        elif index_backends.needs_training(backend):
+            search_settings = [(f"{backend} np={nprobe}", {"nprobe": nprobe}) for nprobe in args.nprobe]
+        else:
+            search_settings = [(backend, {})]
+
+        for label, params in search_settings:
+            index_backends.set_search_params(index, **params)
+            found_ids, latencies_ms = measure_search(index, queries, args.k)
+            print(f"{label:<22} {build_time:>10.2f} {size_mb:>10.1f} {np.percentile(latencies_ms, 50):>10.3f} "
+                  f"{np.percentile(latencies_ms, 99):>10.3f} {recall_at_k(found_ids, exact_ids):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
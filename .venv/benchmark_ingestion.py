@@ -0,0 +1,138 @@
+"""
+Compara a extração + chunking da base de conhecimento no caminho antigo (serial, texto do PDF inteiro montado com
+str += e só depois dividido em chunks) com o pipeline atual do RAGSystem (blocos de páginas extraídos em paralelo
+e chunker em fluxo), com 1 e com N processos.
+
+Uso:
+    python benchmark_ingestion.py --workers 4
+    python benchmark_ingestion.py --kb-dir knowledge_base --workers 8
+
+Mede só extração e chunking: o modelo de embedding não é carregado e nada é gravado no cache do RAG.
+Cada modo roda em um processo Python separado, para que o pico de memória (RSS máximo, somando os processos
+de extração) de um modo não contamine o do outro.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pypdf
+
+import rag
+from rag import RAGSystem
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def legacy_extract_and_chunk(pdf_path: str, chunk_size: int, chunk_overlap: int) -> list[str]:
+    """Caminho anterior ao pipeline em fluxo (RAGSystem._extract_text_from_pdf_kb + _chunk_text), mantido como referência."""
+    full_text = ""
+    with open(pdf_path, 'rb') as file:
+        reader = pypdf.PdfReader(file)
+        for page_num in range(len(reader.pages)):
+            page_text = reader.pages[page_num].extract_text()
+            if page_text:
+                full_text += page_text + "\n"
+
+    chunks = []
+    start = 0
+    while start < len(full_text):
+        chunks.append(full_text[start:start + chunk_size])
+        start += chunk_size - chunk_overlap
+    return chunks
+
+
+def run_legacy(pdf_files: dict[str, str]) -> tuple[int, str]:
+    digest = hashlib.sha256()
+    num_chunks = 0
+    for pdf_path in pdf_files.values():
+        for chunk in legacy_extract_and_chunk(pdf_path, CHUNK_SIZE, CHUNK_OVERLAP):
+            digest.update(chunk.encode('utf-8'))
+            num_chunks += 1
+    return num_chunks, digest.hexdigest()
+
+
+def run_pipeline(pdf_files: dict[str, str], workers: int) -> tuple[int, str]:
+    # Só a parte de extração/chunking do RAGSystem: sem __init__, que carregaria o modelo e o cache
+    rag_system = RAGSystem.__new__(RAGSystem)
+    rag_system.chunk_size = CHUNK_SIZE
+    rag_system.chunk_overlap = CHUNK_OVERLAP
+    rag_system.ingest_workers = workers
+
+    digest = hashlib.sha256()
+    num_chunks = 0
+    extracted = rag_system._iter_extracted_texts(pdf_files)
+    for _, group in itertools.groupby(extracted, key=lambda item: item[0]):
+        chunks = rag_system._iter_chunks(text for _, text in group)
+        # Consome em lotes, como o _add_document faz com os embeddings
+        while batch := list(itertools.islice(chunks, rag.EMBEDDING_BATCH_SIZE)):
+            for chunk in batch:
+                digest.update(chunk.encode('utf-8'))
+            num_chunks += len(batch)
+    return num_chunks, digest.hexdigest()
+
+
+def run_mode(kb_directory: str, mode: str, workers: int):
+    """Executado no processo filho: roda um modo e imprime o resultado em JSON."""
+    pdf_files = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(kb_directory, "*.pdf")))}
+    start_time = time.perf_counter()
+    if mode == "legacy":
+        num_chunks, digest = run_legacy(pdf_files)
+    else:
+        num_chunks, digest = run_pipeline(pdf_files, workers)
+    elapsed = time.perf_counter() - start_time
+
+    # ru_maxrss em KB no Linux (bytes no macOS); RUSAGE_CHILDREN é o maior pico entre os processos de extração
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    peak_rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    print(json.dumps({"time": elapsed, "chunks": num_chunks, "digest": digest, "peak_rss": peak_rss, "peak_rss_children": peak_rss_children}))
+
+
+def measure(kb_directory: str, mode: str, workers: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--kb-dir", kb_directory, "--workers", str(workers), "--run-mode", mode],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da extração + chunking da base de conhecimento (caminho antigo x pipeline atual).")
+    parser.add_argument("--kb-dir", default="knowledge_base", help="Diretório com os PDFs da base de conhecimento.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de extração no modo paralelo.")
+    parser.add_argument("--run-mode", choices=("legacy", "pipeline"), help=argparse.SUPPRESS) # Uso interno (processo filho)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.run_mode:
+        run_mode(args.kb_dir, args.run_mode, args.workers)
+        return
+
+    results = [
+        ("Antigo (serial, str +=)", measure(args.kb_dir, "legacy", 1)),
+        ("Pipeline, 1 processo", measure(args.kb_dir, "pipeline", 1)),
+        (f"Pipeline, {args.workers} processos", measure(args.kb_dir, "pipeline", args.workers)),
+    ]
+
+    baseline_time = results[0][1]["time"]
+    print("\n=== Benchmark de extração + chunking ===")
+    print(f"{'modo':<26} {'tempo (s)':>10} {'speedup':>8} {'chunks':>8} {'pico RSS (MB)':>14} {'pico RSS filhos (MB)':>21}")
+    for label, result in results:
+        speedup = baseline_time / result["time"] if result["time"] > 0 else float("inf")
+        print(f"{label:<26} {result['time']:>10.2f} {speedup:>7.2f}x {result['chunks']:>8} "
+              f"{result['peak_rss'] / (1024 * 1024):>14.1f} {result['peak_rss_children'] / (1024 * 1024):>21.1f}")
+    if len({result["digest"] for _, result in results}) > 1:
+        print("AVISO: os chunks gerados pelos modos são diferentes!")
+
+
+if __name__ == '__main__':
+    main()
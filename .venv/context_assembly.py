@@ -0,0 +1,117 @@
+from typing import Callable
+
+import numpy as np
+
+# Estimativa de tokens sem depender do tokenizer do Gemini (~4 caracteres por token em português)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + " [...]"
+
+
+def merge_adjacent_chunks(chunk_ids: list[int], chunk_texts: dict[int, str], chunk_documents: dict[int, str], chunk_overlap: int) -> list[tuple[list[int], str]]:
+    """
+    Junta chunks consecutivos do mesmo documento em um único trecho contínuo, sem repetir os chunk_overlap
+    caracteres que cada chunk compartilha com o anterior. Retorna [(IDs do trecho, texto do trecho)] na ordem dos IDs.
+    """
+    spans = []
+    for chunk_id in sorted(set(chunk_ids)):
+        if spans and spans[-1][0][-1] == chunk_id - 1 and chunk_documents.get(chunk_id) == chunk_documents.get(chunk_id - 1):
+            spans[-1][0].append(chunk_id)
+            spans[-1][1].append(chunk_texts[chunk_id][chunk_overlap:])
+        else:
+            spans.append(([chunk_id], [chunk_texts[chunk_id]]))
+    return [(span_ids, "".join(parts)) for span_ids, parts in spans]
+
+
+def mmr_rank(candidate_ids: list[int], relevance: dict[int, float], embeddings: np.ndarray, chunk_documents: dict[int, str],
+             lambda_: float = 0.7, document_penalty: float = 0.05) -> list[int]:
+    """
+    Reordena os candidatos por Maximal Marginal Relevance: a cada passo escolhe o chunk mais relevante que seja
+    menos parecido com os já escolhidos. document_penalty desfavorece escolher de novo o mesmo documento de origem.
+    embeddings deve estar normalizado e alinhado com candidate_ids.
+    """
+    similarities = embeddings @ embeddings.T
+    remaining = list(range(len(candidate_ids)))
+    selected = []
+    picks_per_document = {}
+
+    while remaining:
+        def mmr_score(i):
+            max_similarity = max((similarities[i][j] for j in selected), default=0.0)
+            repeats = picks_per_document.get(chunk_documents.get(candidate_ids[i]), 0)
+            return lambda_ * relevance[candidate_ids[i]] - (1 - lambda_) * max_similarity - document_penalty * repeats
+
+        best = max(remaining, key=mmr_score)
+        remaining.remove(best)
+        selected.append(best)
+        document = chunk_documents.get(candidate_ids[best])
+        picks_per_document[document] = picks_per_document.get(document, 0) + 1
+
+    return [candidate_ids[i] for i in selected]
+
+
+def fill_chunk_budget(ordered_ids: list[int], chunk_texts: dict[int, str], chunk_documents: dict[int, str], chunk_overlap: int,
+                      max_tokens: int, max_chunks: int | None = None, keep_document_order: bool = False) -> tuple[list[int], list[str]]:
+    """
+    Percorre os chunks na ordem de preferência e mantém cada um se, depois de juntar os trechos adjacentes,
+    o total ainda couber em max_tokens. Retorna (IDs escolhidos, textos dos trechos).
+    Os trechos saem na ordem de preferência ou, com keep_document_order, na ordem em que aparecem no documento.
+    """
+    selected = []
+    for chunk_id in ordered_ids:
+        if max_chunks is not None and len(selected) >= max_chunks:
+            break
+        spans = merge_adjacent_chunks(selected + [chunk_id], chunk_texts, chunk_documents, chunk_overlap)
+        if sum(estimate_tokens(text) for _, text in spans) <= max_tokens:
+            selected.append(chunk_id)
+
+    spans = merge_adjacent_chunks(selected, chunk_texts, chunk_documents, chunk_overlap)
+    if not keep_document_order:
+        rank = {chunk_id: i for i, chunk_id in enumerate(ordered_ids)}
+        spans.sort(key=lambda span: min(rank[chunk_id] for chunk_id in span[0]))
+    return selected, [text for _, text in spans]
+
+
+def select_passages(text: str, max_tokens: int, rag_system=None, query_embedding: np.ndarray | None = None,
+                    embed_chunks: Callable[[list[str]], np.ndarray] | None = None) -> str:
+    """
+    Reduz um texto (ex: arquivo anexado) ao orçamento de tokens. Se couber, volta inteiro; se houver pergunta e RAG,
+    mantém os chunks mais parecidos com a pergunta (na ordem do documento, separados por '[...]'); senão, mantém o começo do texto.
+    embed_chunks calcula os embeddings dos chunks (padrão: rag_system.embed_texts_cached); o chamador pode passar uma
+    função que reaproveita embeddings já guardados para o documento, só chamada se o texto não couber.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if rag_system is None or query_embedding is None:
+        return truncate_to_tokens(text, max_tokens)
+
+    chunks = rag_system.chunk_text(text)
+    chunk_texts = dict(enumerate(chunks))
+    scores = (embed_chunks or rag_system.embed_texts_cached)(chunks) @ query_embedding.reshape(-1)
+    ordered_ids = [int(i) for i in np.argsort(-scores)]
+    _, passages = fill_chunk_budget(ordered_ids, chunk_texts, {}, rag_system.chunk_overlap, max_tokens, keep_document_order=True)
+    return "\n[...]\n".join(passages)
+
+
+def select_history(turns: list[dict], max_tokens: int) -> list[dict]:
+    """Mantém as turnos mais recentes que cabem no orçamento (a mais recente sempre entra, truncada se preciso)."""
+    selected = []
+    used_tokens = 0
+    for turn in reversed(turns):
+        turn_tokens = estimate_tokens(turn.get('user', '')) + estimate_tokens(turn.get('ai', ''))
+        if selected and used_tokens + turn_tokens > max_tokens:
+            break
+        if not selected and turn_tokens > max_tokens:
+            turn = {'user': turn.get('user', ''), 'ai': truncate_to_tokens(turn.get('ai', ''), max(0, max_tokens - estimate_tokens(turn.get('user', ''))))}
+        selected.append(turn)
+        used_tokens += turn_tokens
+    return list(reversed(selected))
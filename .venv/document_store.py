@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import logging
+import time
+import uuid
+import sqlite3
+import threading
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Palavras ignoradas ao buscar os termos de uma pergunta no arquivo anexado
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas",
+    "por", "para", "pelo", "pela", "com", "sem", "sobre", "que", "qual", "quais", "quem", "como", "onde", "quando",
+    "e", "ou", "se", "eu", "me", "meu", "minha", "voce", "ele", "ela", "isso", "isto", "esse", "essa", "este", "esta",
+    "ha", "tem", "ter", "ser", "estar", "foi", "sao", "nao", "sim", "mais", "menos", "muito", "ao", "aos", "arquivo",
+    "documento", "texto", "anexo", "anexado", "aparece", "existe", "algum", "alguma", "fale", "diga", "procure", "busque",
+}
+MIN_TERM_LENGTH = 2
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_token(token: str) -> str:
+    """Minúsculas e sem acentos, para que 'Rescisão' e 'rescisao' sejam o mesmo termo."""
+    decomposed = unicodedata.normalize("NFD", token.lower())
+    return "".join(char for char in decomposed if unicodedata.category(char) != "Mn")
+
+
+def build_inverted_index(text: str) -> dict[str, list[int]]:
+    """Percorre o texto uma única vez e retorna {termo normalizado: [posições (em caracteres) no texto original]}."""
+    index = {}
+    for match in _TOKEN_PATTERN.finditer(text):
+        index.setdefault(normalize_token(match.group()), []).append(match.start())
+    return index
+
+
+def query_terms(query: str) -> list[str]:
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(query):
+        term = normalize_token(match.group())
+        if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def search_inverted_index(text: str, index: dict[str, list[int]], query: str, snippet_size: int = 150, max_snippets: int = 20) -> list[str]:
+    """
+    Busca os termos da pergunta no índice invertido do texto e retorna os trechos ao redor das ocorrências.
+    Ocorrências próximas são agrupadas em um único trecho; os trechos seguem a ordem do texto.
+    """
+    positions = []
+    for term in query_terms(query):
+        positions.extend((position, position + len(term)) for position in index.get(term, []))
+    if not positions:
+        return []
+    positions.sort()
+
+    windows = []
+    for start, end in positions:
+        window_start, window_end = max(0, start - snippet_size), min(len(text), end + snippet_size)
+        if windows and window_start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], window_end)
+        else:
+            windows.append([window_start, window_end])
+
+    snippets = []
+    for window_start, window_end in windows[:max_snippets]:
+        prefix = "..." if window_start > 0 else ""
+        suffix = "..." if window_end < len(text) else ""
+        snippets.append(prefix + text[window_start:window_end].strip() + suffix)
+    return snippets
+
+
+class DocumentStore:
+    """
+    Guarda no servidor (SQLite) o texto completo dos arquivos anexados em cada sessão, junto com o índice invertido
+    (uma linha por termo, para que cada busca leia só os termos da pergunta), e o histórico de chat de cada sessão
+    (que precisa ser gravado ao fim de um streaming, quando o cookie já foi enviado).
+    O cookie da sessão carrega apenas IDs. Registros não acessados por ttl_seconds são removidos.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = 3600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        with self._connection() as conn:
+            # Bancos antigos guardavam o índice inteiro em JSON na coluna inverted_index; os dados são temporários (TTL),
+            # então a tabela é simplesmente recriada no formato novo
+            if "inverted_index" in [row[1] for row in conn.execute("PRAGMA table_info(documents)")]:
+                conn.execute("DROP TABLE documents")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_expires_at ON documents (expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_terms (
+                    doc_id TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    positions TEXT NOT NULL,
+                    PRIMARY KEY (doc_id, term)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_embeddings (
+                    doc_id TEXT PRIMARY KEY,
+                    num_chunks INTEGER NOT NULL,
+                    dimension INTEGER NOT NULL,
+                    embeddings BLOB NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_histories (
+                    session_key TEXT PRIMARY KEY,
+                    history TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Uma conexão por thread (o servidor do Flask atende cada requisição em uma thread)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM document_terms WHERE doc_id IN (SELECT doc_id FROM documents WHERE expires_at < ?)", (now,))
+            conn.execute("DELETE FROM document_embeddings WHERE doc_id IN (SELECT doc_id FROM documents WHERE expires_at < ?)", (now,))
+            deleted = conn.execute("DELETE FROM documents WHERE expires_at < ?", (now,)).rowcount
+            conn.execute("DELETE FROM chat_histories WHERE expires_at < ?", (now,))
+        if deleted:
+            logger.debug('[DocumentStore] %s documento(s) expirado(s) removido(s).', deleted)
+        return deleted
+
+    def put(self, file_name: str, content: str) -> str:
+        """Salva o texto de um arquivo, constrói seu índice invertido e retorna o ID do documento."""
+        self.evict_expired()
+        doc_id = uuid.uuid4().hex
+        inverted_index = build_inverted_index(content)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO documents (doc_id, file_name, content, expires_at) VALUES (?, ?, ?, ?)",
+                (doc_id, file_name, content, time.time() + self.ttl_seconds)
+            )
+            conn.executemany(
+                "INSERT INTO document_terms (doc_id, term, positions) VALUES (?, ?, ?)",
+                ((doc_id, term, json.dumps(positions)) for term, positions in inverted_index.items())
+            )
+        logger.debug("[DocumentStore] Documento '%s' salvo (%s chars, %s termos distintos).", file_name, len(content), len(inverted_index))
+        return doc_id
+
+    def get(self, doc_id: str | None) -> dict | None:
+        """Retorna {"file_name", "content"} e renova o TTL. None se não existir ou tiver expirado."""
+        if not doc_id:
+            return None
+        with self._connection() as conn:
+            row = conn.execute("SELECT file_name, content FROM documents WHERE doc_id = ? AND expires_at >= ?", (doc_id, time.time())).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE documents SET expires_at = ? WHERE doc_id = ?", (time.time() + self.ttl_seconds, doc_id))
+        return {"file_name": row[0], "content": row[1]}
+
+    def search(self, doc_id: str | None, query: str, snippet_size: int = 150, max_snippets: int = 20, content: str | None = None) -> list[str]:
+        """
+        Busca os termos da pergunta no documento lendo do banco apenas as posições desses termos.
+        Se o chamador já tem o texto do documento (ex: de um get() na mesma requisição), pode passá-lo em content.
+        """
+        if not doc_id:
+            return []
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._connection() as conn:
+            if content is None:
+                row = conn.execute("SELECT content FROM documents WHERE doc_id = ? AND expires_at >= ?", (doc_id, time.time())).fetchone()
+                if row is None:
+                    return []
+                content = row[0]
+            placeholders = ", ".join("?" * len(terms))
+            rows = conn.execute(f"SELECT term, positions FROM document_terms WHERE doc_id = ? AND term IN ({placeholders})", (doc_id, *terms)).fetchall()
+        index = {term: json.loads(positions) for term, positions in rows}
+        return search_inverted_index(content, index, query, snippet_size, max_snippets)
+
+    def put_embeddings(self, doc_id: str, embeddings: np.ndarray):
+        """Guarda os embeddings dos chunks do documento, calculados uma vez e reaproveitados nas perguntas seguintes."""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO document_embeddings (doc_id, num_chunks, dimension, embeddings) VALUES (?, ?, ?, ?)",
+                         (doc_id, embeddings.shape[0], embeddings.shape[1], embeddings.tobytes()))
+
+    def get_embeddings(self, doc_id: str | None) -> np.ndarray | None:
+        """Embeddings dos chunks guardados por put_embeddings (matriz num_chunks x dimension), ou None."""
+        if not doc_id:
+            return None
+        with self._connection() as conn:
+            row = conn.execute("SELECT num_chunks, dimension, embeddings FROM document_embeddings WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[2], dtype='float32').reshape(row[0], row[1])
+
+    def delete(self, doc_id: str | None):
+        if not doc_id:
+            return
+        with self._connection() as conn:
+            conn.execute("DELETE FROM document_terms WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM document_embeddings WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    # --- Histórico de chat por sessão ---
+
+    def get_chat_history(self, session_key: str | None) -> list[dict]:
+        if not session_key:
+            return []
+        with self._connection() as conn:
+            row = conn.execute("SELECT history FROM chat_histories WHERE session_key = ? AND expires_at >= ?", (session_key, time.time())).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def save_chat_history(self, session_key: str, history: list[dict]):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_histories (session_key, history, expires_at) VALUES (?, ?, ?)",
+                (session_key, json.dumps(history, ensure_ascii=False), time.time() + self.ttl_seconds)
+            )
+
+    def delete_chat_history(self, session_key: str | None):
+        if not session_key:
+            return
+        with self._connection() as conn:
+            conn.execute("DELETE FROM chat_histories WHERE session_key = ?", (session_key,))
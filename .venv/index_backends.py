@@ -0,0 +1,139 @@
+import faiss
+import numpy as np
+
+# Backends de índice FAISS disponíveis para o RAG.
+# Todos usam produto interno sobre vetores normalizados (L2), ou seja, similaridade de cosseno.
+#   flat      -> busca exata (força bruta). Padrão.
+#   flat_fp16 -> busca exata com vetores comprimidos em float16 (metade da memória)
+#   hnsw      -> grafo HNSW (aproximado, rápido; não remove vetores, então remoções reconstroem o índice)
+#   ivf_flat  -> listas invertidas com vetores completos (aproximado, precisa de treino)
+#   ivf_pq    -> listas invertidas com Product Quantization (aproximado, muito menos memória, precisa de treino)
+INDEX_BACKENDS = ("flat", "flat_fp16", "hnsw", "ivf_flat", "ivf_pq")
+DEFAULT_INDEX_BACKEND = "flat"
+
+# Parâmetros de construção (mudá-los invalida o cache do índice)
+DEFAULT_BUILD_PARAMS = {
+    "hnsw_m": 32, # Vizinhos por nó no grafo HNSW
+    "hnsw_ef_construction": 80,
+    "ivf_nlist": 256, # Número máximo de listas invertidas (reduzido automaticamente para bases pequenas)
+    "pq_m": 48, # Subquantizadores do PQ (precisa dividir a dimensão do embedding)
+    "pq_nbits": 8,
+}
+
+# Parâmetros de busca (podem mudar a qualquer momento, sem reindexar)
+DEFAULT_NPROBE = 16 # Listas invertidas visitadas por busca (IVF)
+DEFAULT_EF_SEARCH = 64 # Tamanho da fila de candidatos na busca (HNSW)
+
+MIN_TRAINING_POINTS_PER_LIST = 39 # Abaixo disso o k-means do FAISS avisa que o treino é insuficiente
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Retorna uma cópia float32 dos embeddings com norma L2 unitária (produto interno = cosseno)."""
+    embeddings = np.array(embeddings, dtype='float32', copy=True).reshape(len(embeddings), -1)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def needs_training(backend: str) -> bool:
+    return backend in ("ivf_flat", "ivf_pq")
+
+
+def supports_removal(backend: str) -> bool:
+    return backend != "hnsw"
+
+
+def _factory_string(backend: str, dimension: int, num_training_vectors: int, params: dict) -> str:
+    if backend == "flat":
+        return "Flat"
+    if backend == "flat_fp16":
+        return "SQfp16"
+    if backend == "hnsw":
+        return f"HNSW{params['hnsw_m']},Flat"
+
+    nlist = max(1, min(params["ivf_nlist"], num_training_vectors // MIN_TRAINING_POINTS_PER_LIST))
+    if backend == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if backend == "ivf_pq":
+        if dimension % params["pq_m"] != 0:
+            raise ValueError(f"pq_m={params['pq_m']} não divide a dimensão do embedding ({dimension}).")
+        return f"IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+    raise ValueError(f"Backend de índice desconhecido: '{backend}'. Opções: {', '.join(INDEX_BACKENDS)}")
+
+
+def build_index(backend: str, dimension: int, num_training_vectors: int = 0, params: dict | None = None) -> faiss.Index:
+    """
+    Cria um índice vazio do backend escolhido, indexado pelos IDs dos chunks.
+    Os índices IVF já guardam IDs próprios (e removem por ID); os demais são envolvidos em IndexIDMap2,
+    que não pode ser usado com IVF porque o IVF não compacta seus IDs internos após uma remoção.
+    Para backends com treino, num_training_vectors ajusta o número de listas ao tamanho da base.
+    """
+    params = {**DEFAULT_BUILD_PARAMS, **(params or {})}
+    factory_string = _factory_string(backend, dimension, num_training_vectors, params)
+    index = faiss.index_factory(dimension, factory_string, faiss.METRIC_INNER_PRODUCT)
+
+    if needs_training(backend):
+        return index
+    if backend == "hnsw":
+        index.hnsw.efConstruction = params["hnsw_ef_construction"]
+    return faiss.IndexIDMap2(index)
+
+
+def min_training_vectors(backend: str, params: dict | None = None) -> int:
+    """Quantidade mínima de vetores para treinar o backend (0 se não precisar de treino)."""
+    if not needs_training(backend):
+        return 0
+    params = {**DEFAULT_BUILD_PARAMS, **(params or {})}
+    if backend == "ivf_pq":
+        # O k-means de cada subquantizador do PQ precisa de pelo menos 2^nbits pontos
+        return 2 ** params["pq_nbits"]
+    return MIN_TRAINING_POINTS_PER_LIST
+
+
+def set_search_params(index: faiss.Index, nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
+    """Aplica nprobe (IVF) ou efSearch (HNSW) ao índice interno; não faz nada para índices exatos."""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(nprobe, inner.nlist)
+
+
+def mmap_read_flags(backend: str) -> int:
+    """
+    Flags do faiss.read_index para abrir o índice do cache via mmap, compartilhando as páginas entre processos.
+    IO_FLAG_MMAP só mapeia as listas invertidas (IVF); os códigos de índices flat (flat, flat_fp16 e o armazenamento
+    do HNSW) só ficam fora da memória privada com IO_FLAG_MMAP_IFC (FAISS >= 1.11).
+    """
+    if needs_training(backend):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def enable_reconstruct(index: faiss.Index):
+    """
+    Permite index.reconstruct(id) em todos os backends. Os envolvidos em IndexIDMap2 já mapeiam ID -> posição;
+    o IVF (IDs nativos) precisa de um direct map, em tabela hash porque os IDs não são sequenciais após remoções.
+    """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def reconstruct_vectors(index: faiss.Index, ids: list[int]) -> np.ndarray:
+    """Vetores guardados no índice para os IDs (aproximados no fp16 e no PQ), normalizados de novo."""
+    if not ids:
+        return np.zeros((0, index.d), dtype='float32')
+    return normalize(np.vstack([index.reconstruct(int(chunk_id)) for chunk_id in ids]))
+
+
+def index_vectors(index: faiss.IndexIDMap2) -> tuple[np.ndarray, np.ndarray]:
+    """Retorna (ids, vetores) de todos os vetores de um índice envolvido em IndexIDMap2 (flat, flat_fp16, hnsw)."""
+    ids = faiss.vector_to_array(index.id_map).astype('int64')
+    if index.ntotal == 0:
+        return ids, np.zeros((0, index.d), dtype='float32')
+    return ids, index.index.reconstruct_n(0, index.ntotal)
+
+
+def index_size_bytes(index: faiss.Index) -> int:
+    """Tamanho do índice serializado, usado como estimativa da memória ocupada."""
+    return int(faiss.serialize_index(index).nbytes)
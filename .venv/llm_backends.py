@@ -0,0 +1,128 @@
+import time
+import logging
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKENDS = ("gemini", "fake")
+
+
+class LLMResponseInterrupted(Exception):
+    """A resposta foi cortada no meio do streaming (ex: bloqueada pelos filtros de segurança); a mensagem vai para o usuário."""
+
+
+class LLMEmptyResponse(Exception):
+    """A IA não gerou texto (ex: prompt bloqueado); a mensagem vai para o usuário, mas não é uma resposta para o cache."""
+
+
+class LLMBackend:
+    """Interface mínima do modelo de linguagem usado pelo /ask: resposta completa ou em pedaços (streaming)."""
+
+    name = "base"
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name: str = 'models/gemini-2.0-flash'):
+        import google.generativeai as genai
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _empty_response_error(ai_response) -> LLMEmptyResponse:
+        # Tenta pegar algum feedback do prompt para incluir na resposta de erro, se disponível
+        feedback = ""
+        if hasattr(ai_response, 'prompt_feedback') and ai_response.prompt_feedback:
+             feedback_reason = []
+             if hasattr(ai_response.prompt_feedback, 'block_reason'):
+                  feedback_reason.append(f"Block Reason: {ai_response.prompt_feedback.block_reason.name}")
+             if hasattr(ai_response.prompt_feedback, 'safety_ratings'):
+                  ratings = [f"{r.category.name}: {r.probability.name}" for r in ai_response.prompt_feedback.safety_ratings]
+                  feedback_reason.append(f"Safety Ratings: {', '.join(ratings)}")
+             if feedback_reason:
+                  feedback = " (Feedback: " + "; ".join(feedback_reason) + ")"
+        logger.warning('[LLM] Resposta da IA vazia. Feedback: %s', feedback)
+        return LLMEmptyResponse(f"Desculpe, não consegui gerar uma resposta para isso no momento.{feedback}")
+
+    def generate(self, prompt: str) -> str:
+        ai_response = self.model.generate_content(prompt)
+        try:
+            text = ai_response.text if ai_response else ""
+        except ValueError:
+            text = "" # Resposta bloqueada (sem partes de texto)
+        if text:
+            return text
+        raise self._empty_response_error(ai_response)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        ai_response = self.model.generate_content(prompt, stream=True)
+        has_text = False
+        try:
+            for chunk in ai_response:
+                if chunk.text:
+                    has_text = True
+                    yield chunk.text
+        except ValueError:
+            # chunk.text lança ValueError quando a resposta foi bloqueada (sem partes de texto)
+            if has_text:
+                # Parte da resposta já foi enviada: sinaliza o corte para o /ask_stream emitir o evento de erro
+                # (e a resposta incompleta não entrar no cache de respostas)
+                finish_reason = ""
+                if getattr(chunk, 'candidates', None) and hasattr(chunk.candidates[0], 'finish_reason'):
+                    finish_reason = f" (Finish Reason: {chunk.candidates[0].finish_reason.name})"
+                logger.warning('[LLM] Resposta da IA interrompida no meio do streaming.%s', finish_reason)
+                raise LLMResponseInterrupted(f"A resposta da IA foi interrompida antes do fim e pode estar incompleta.{finish_reason}")
+        finally:
+            # Gerador fechado antes do fim (cliente desconectou): cancela a chamada gRPC, senão a API continua gerando
+            # (e cobrando) o resto da resposta. Em uma chamada já concluída o cancelamento não faz nada
+            self._cancel_stream(ai_response)
+        if not has_text:
+            raise self._empty_response_error(ai_response)
+
+    @staticmethod
+    def _cancel_stream(ai_response):
+        # O google-generativeai não expõe close() na resposta em streaming; o iterador gRPC interno tem cancel()
+        response_iterator = getattr(ai_response, '_iterator', None)
+        for method_name in ('cancel', 'close'):
+            method = getattr(response_iterator, method_name, None)
+            if callable(method):
+                try:
+                    method()
+                except Exception as e:
+                    logger.debug('[LLM] Não foi possível cancelar o streaming da IA: %s', e)
+                return
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Backend local, sem rede, para desenvolvimento e testes do /ask (inclusive do streaming).
+    Responde com um texto fixo que cita o tamanho do prompt, emitido palavra a palavra com token_delay segundos entre elas.
+    """
+
+    name = "fake"
+
+    def __init__(self, token_delay: float = 0.0, first_token_delay: float = 0.0):
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        answer = f"**Resposta simulada** (backend fake) para um prompt de {len(prompt)} caracteres.\n\nEsta resposta foi gerada localmente, sem chamar a API do Gemini."
+        time.sleep(self.first_token_delay)
+        for i, word in enumerate(answer.split(" ")):
+            if i > 0:
+                time.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+
+def create_llm_backend(name: str, gemini_model_name: str = 'models/gemini-2.0-flash') -> LLMBackend:
+    if name == "gemini":
+        return GeminiBackend(gemini_model_name)
+    if name == "fake":
+        return FakeLLMBackend()
+    raise ValueError(f"Backend de LLM desconhecido: '{name}'. Opções: {', '.join(LLM_BACKENDS)}")
@@ -0,0 +1,85 @@
+"""
+Métricas de latência por etapa, sem dependências externas, exportadas no formato de texto do Prometheus.
+
+    with timed("faiss_search"):
+        ...
+
+Cada etapa alimenta o histograma harvey_stage_duration_seconds{stage="..."} (exposto em /metrics) e uma janela
+com as últimas observações, usada para calcular p50/p95/p99 no benchmark.
+"""
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGE_HISTOGRAM_NAME = "harvey_stage_duration_seconds"
+# Limites dos buckets em segundos: de buscas no FAISS (sub-ms) a chamadas ao Gemini e OCR (dezenas de segundos)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_SAMPLES = 10000 # Observações mantidas por etapa para os percentis
+
+
+class StageMetrics:
+    """Histogramas de duração por etapa (thread-safe)."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS, recent_samples: int = RECENT_SAMPLES):
+        self.buckets = buckets
+        self.recent_samples = recent_samples
+        self._stages = {} # Etapa -> {"bucket_counts", "count", "sum", "recent"}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            data = self._stages.get(stage)
+            if data is None:
+                data = {"bucket_counts": [0] * len(self.buckets), "count": 0, "sum": 0.0, "recent": deque(maxlen=self.recent_samples)}
+                self._stages[stage] = data
+            for i, upper_bound in enumerate(self.buckets):
+                if seconds <= upper_bound:
+                    data["bucket_counts"][i] += 1
+            data["count"] += 1
+            data["sum"] += seconds
+            data["recent"].append(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def quantiles(self, percentiles: tuple[float, ...] = (50, 95, 99)) -> dict[str, dict]:
+        """{etapa: {"count", "p50", "p95", "p99"}} em segundos, calculado sobre as observações recentes."""
+        with self._lock:
+            recent = {stage: list(data["recent"]) for stage, data in self._stages.items()}
+            counts = {stage: data["count"] for stage, data in self._stages.items()}
+        summary = {}
+        for stage, samples in recent.items():
+            values = np.percentile(samples, percentiles) if samples else [0.0] * len(percentiles)
+            summary[stage] = {"count": counts[stage], **{f"p{p:g}": float(v) for p, v in zip(percentiles, values)}}
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def render_prometheus(self) -> str:
+        lines = [
+            f"# HELP {STAGE_HISTOGRAM_NAME} Duração de cada etapa do processamento (segundos).",
+            f"# TYPE {STAGE_HISTOGRAM_NAME} histogram",
+        ]
+        with self._lock:
+            for stage, data in sorted(self._stages.items()):
+                for upper_bound, bucket_count in zip(self.buckets, data["bucket_counts"]):
+                    lines.append(f'{STAGE_HISTOGRAM_NAME}_bucket{{stage="{stage}",le="{upper_bound:g}"}} {bucket_count}')
+                lines.append(f'{STAGE_HISTOGRAM_NAME}_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+                lines.append(f'{STAGE_HISTOGRAM_NAME}_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+                lines.append(f'{STAGE_HISTOGRAM_NAME}_count{{stage="{stage}"}} {data["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Instância usada pela aplicação (app.py, rag.py, upload_jobs.py)
+stage_metrics = StageMetrics()
+timed = stage_metrics.timed
@@ -0,0 +1,599 @@
+import os
+import glob
+import json
+import time
+import logging
+import hashlib
+import itertools
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+import pypdf # Necessário para carregar PDFs da base de conhecimento
+
+import index_backends
+from metrics import timed
+
+try:
+    import fcntl # Lock entre processos do cache (ex: vários workers do gunicorn); indisponível no Windows
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Arquivos que compõem o cache persistente do RAG (dentro de cache_directory)
+CACHE_INDEX_FILE = "index.faiss"
+CACHE_CHUNKS_FILE = "chunks.json"
+CACHE_MANIFEST_FILE = "manifest.json"
+CACHE_LOCK_FILE = ".lock"
+CACHE_FORMAT_VERSION = 2 # v2: embeddings normalizados (cosseno) e backend de índice configurável
+
+# Ingestão da base de conhecimento
+PAGES_PER_EXTRACTION_TASK = 16 # Páginas extraídas por tarefa enviada a um processo do pool
+EMBEDDING_BATCH_SIZE = 64 # Chunks por chamada de embedding_model.encode
+EMBEDDING_CACHE_SIZE = 4096 # Embeddings de consultas (perguntas e chunks de arquivos anexados) mantidos em memória
+
+
+def _file_sha256(file_path: str) -> str:
+    """Calcula o hash SHA-256 do conteúdo de um arquivo, lendo em blocos."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _count_pdf_pages(pdf_file_path: str) -> int:
+    try:
+        with open(pdf_file_path, 'rb') as file:
+            return len(pypdf.PdfReader(file).pages)
+    except Exception as e:
+        logger.error('[RAG System] Erro ao abrir o arquivo KB %s: %s', os.path.basename(pdf_file_path), e)
+        return 0
+
+
+def _extract_pdf_page_range(pdf_file_path: str, start_page: int, end_page: int) -> str:
+    """Extrai o texto das páginas [start_page, end_page) de um PDF. Roda nos processos do pool de ingestão."""
+    page_texts = []
+    try:
+        with open(pdf_file_path, 'rb') as file:
+            reader = pypdf.PdfReader(file)
+            for page_num in range(start_page, end_page):
+                page_text = reader.pages[page_num].extract_text()
+                if page_text:
+                    page_texts.append(page_text + "\n")
+    except Exception as e:
+        logger.error('[RAG System] Erro ao extrair texto do arquivo KB %s (páginas %s-%s): %s', os.path.basename(pdf_file_path), start_page, end_page, e)
+    return "".join(page_texts)
+
+
+def _atomic_write(file_path: str, write_fn) -> None:
+    """Escreve em um arquivo temporário e o move para o destino, evitando caches corrompidos pela metade."""
+    tmp_path = f"{file_path}.tmp-{os.getpid()}"
+    write_fn(tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+class RAGSystem:
+    def __init__(self, kb_directory, chunk_size, chunk_overlap, embedding_model_name='paraphrase-MiniLM-L6-v2', cache_directory='rag_cache', ingest_workers=None,
+                 index_backend=index_backends.DEFAULT_INDEX_BACKEND, nprobe=index_backends.DEFAULT_NPROBE, ef_search=index_backends.DEFAULT_EF_SEARCH,
+                 embedding_cache_size=EMBEDDING_CACHE_SIZE):
+        self.kb_directory = kb_directory
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedding_model_name = embedding_model_name
+        self.cache_directory = cache_directory
+        # Processos usados para extrair os PDFs (None = todos os núcleos, 1 = extração serial no próprio processo)
+        self.ingest_workers = ingest_workers or os.cpu_count() or 1
+        if index_backend not in index_backends.INDEX_BACKENDS:
+            raise ValueError(f"Backend de índice desconhecido: '{index_backend}'. Opções: {', '.join(index_backends.INDEX_BACKENDS)}")
+        self.index_backend = index_backend
+        self.nprobe = nprobe # Usado pelos backends IVF
+        self.ef_search = ef_search # Usado pelo backend HNSW
+        self.embedding_cache_size = embedding_cache_size
+
+        self.embedding_model = None
+        self.faiss_index = None
+        self.text_chunks = {} # ID do chunk -> texto do chunk
+        self.documents = {} # Nome do PDF -> {"hash", "first_id", "num_chunks"}
+        self.next_chunk_id = 0
+        self.index_version = None # Muda sempre que o conteúdo do índice muda (ex: invalida o cache de respostas)
+        self._untrained_batches = [] # (ids, embeddings) aguardando o treino de um índice IVF
+        self._embedding_cache = OrderedDict() # Hash do texto -> embedding normalizado (LRU)
+        self._embedding_cache_lock = threading.Lock()
+
+        logger.info('[RAG System] Iniciando configuração do RAG...')
+        with timed("rag_initialize"):
+            self._initialize_rag()
+        logger.info('[RAG System] Configuração do RAG finalizada.')
+
+    def _resolve_path(self, directory: str) -> str:
+        # Usa o diretório onde rag.py está como base, que é a raiz do projeto
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+
+    def _list_knowledge_base_pdfs(self) -> dict[str, str]:
+        """Retorna um dicionário {nome do PDF: caminho completo} dos PDFs da base de conhecimento."""
+        kb_dir_path = self._resolve_path(self.kb_directory)
+
+        if not os.path.exists(kb_dir_path):
+            logger.error('[RAG System] Erro: Diretório da base de conhecimento não encontrado: %s', kb_dir_path)
+            return {}
+
+        pdf_files = glob.glob(os.path.join(kb_dir_path, "*.pdf"))
+
+        if not pdf_files:
+            logger.warning('[RAG System] Nenhum arquivo PDF encontrado no diretório: %s', kb_dir_path)
+            return {}
+
+        logger.info('[RAG System] Encontrados %s arquivos PDF no diretório: %s', len(pdf_files), kb_dir_path)
+        return {os.path.basename(pdf_file): pdf_file for pdf_file in sorted(pdf_files)}
+
+    def _iter_chunks(self, text_pieces: Iterable[str]) -> Iterator[str]:
+        """
+        Divide em chunks um texto recebido em pedaços (ex: página a página), sem montar o texto inteiro em memória.
+        Produz exatamente os mesmos chunks que chunk_text aplicado à concatenação dos pedaços.
+        """
+        step = self.chunk_size - self.chunk_overlap
+        if step <= 0:
+            raise ValueError("chunk_overlap deve ser menor que chunk_size.")
+        buffer = ""
+        for piece in text_pieces:
+            buffer += piece
+            while len(buffer) >= self.chunk_size:
+                yield buffer[:self.chunk_size]
+                buffer = buffer[step:]
+        while buffer:
+            yield buffer[:self.chunk_size]
+            buffer = buffer[step:]
+
+    def chunk_text(self, text: str) -> list[str]:
+        if not text:
+             return []
+        return list(self._iter_chunks([text]))
+
+    # --- Extração paralela dos PDFs ---
+
+    def _create_ingest_executor(self) -> ProcessPoolExecutor | None:
+        if self.ingest_workers <= 1:
+            return None
+        # Usa fork quando disponível: com spawn (Windows) os processos filhos reimportariam o app.py e o RAG inteiro
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning('[RAG System] Plataforma sem suporte a fork. Extraindo os PDFs de forma serial.')
+            return None
+        return ProcessPoolExecutor(max_workers=self.ingest_workers, mp_context=multiprocessing.get_context("fork"))
+
+    def _iter_extracted_texts(self, pdf_files: dict[str, str]) -> Iterator[tuple[str, str]]:
+        """
+        Gera (nome do PDF, texto de um bloco de páginas) na ordem dos documentos e das páginas.
+        Os blocos são extraídos em paralelo pelo pool, com no máximo 2 blocos pendentes por processo,
+        de modo que a memória fica limitada e a extração continua enquanto o chamador gera os embeddings.
+        """
+        tasks = []
+        for doc_name, pdf_path in pdf_files.items():
+            num_pages = _count_pdf_pages(pdf_path)
+            for start_page in range(0, num_pages, PAGES_PER_EXTRACTION_TASK):
+                tasks.append((doc_name, pdf_path, start_page, min(start_page + PAGES_PER_EXTRACTION_TASK, num_pages)))
+
+        executor = self._create_ingest_executor()
+        if executor is None:
+            for doc_name, pdf_path, start_page, end_page in tasks:
+                yield doc_name, _extract_pdf_page_range(pdf_path, start_page, end_page)
+            return
+
+        with executor:
+            task_iter = iter(tasks)
+            pending = deque()
+
+            def submit_next():
+                task = next(task_iter, None)
+                if task is not None:
+                    doc_name, pdf_path, start_page, end_page = task
+                    pending.append((doc_name, executor.submit(_extract_pdf_page_range, pdf_path, start_page, end_page)))
+
+            for _ in range(self.ingest_workers * 2):
+                submit_next()
+            while pending:
+                doc_name, future = pending.popleft()
+                submit_next()
+                yield doc_name, future.result()
+
+    # --- Cache persistente (índice FAISS + chunks + manifesto) ---
+
+    def _cache_path(self, file_name: str) -> str:
+        return os.path.join(self._resolve_path(self.cache_directory), file_name)
+
+    def _cache_settings(self) -> dict:
+        """Parâmetros que, se mudarem, invalidam todo o cache (os embeddings deixam de ser comparáveis)."""
+        return {
+            "format_version": CACHE_FORMAT_VERSION,
+            "embedding_model": self.embedding_model_name,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "index_backend": self.index_backend,
+            "index_params": index_backends.DEFAULT_BUILD_PARAMS,
+        }
+
+    def _compute_index_version(self) -> str:
+        """Hash do que está no manifesto (parâmetros e documentos indexados)."""
+        state = {"settings": self._cache_settings(), "documents": self.documents, "next_chunk_id": self.next_chunk_id}
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _read_cached_index(self, writable: bool):
+        index_path = self._cache_path(CACHE_INDEX_FILE)
+        if not writable:
+            # Memory-mapped: vários workers (ex: gunicorn) compartilham as mesmas páginas do arquivo
+            try:
+                return faiss.read_index(index_path, index_backends.mmap_read_flags(self.index_backend))
+            except RuntimeError as e:
+                logger.warning('[RAG System] Não foi possível abrir o índice com mmap (%s). Carregando em memória.', e)
+        return faiss.read_index(index_path)
+
+    @contextmanager
+    def _cache_lock(self, exclusive: bool):
+        """
+        Lock de arquivo entre processos: leitura do cache com lock compartilhado, atualização (reindexar e salvar)
+        com lock exclusivo. Assim só um worker reindexa e nenhum lê um index.faiss novo com um manifest.json antigo.
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self._resolve_path(self.cache_directory), exist_ok=True)
+        with open(self._cache_path(CACHE_LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_cache(self) -> bool:
+        """
+        Carrega índice, chunks e manifesto do cache, descartando o que estiver carregado.
+        Retorna False (com o estado vazio) se o cache não existir ou for incompatível.
+        """
+        self.faiss_index = None
+        self.text_chunks = {}
+        self.documents = {}
+        self.next_chunk_id = 0
+        manifest_path = self._cache_path(CACHE_MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            logger.info('[RAG System] Nenhum cache do RAG encontrado. A base será indexada do zero.')
+            return False
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+
+            if manifest.get("settings") != self._cache_settings():
+                logger.warning('[RAG System] Cache do RAG criado com outros parâmetros (modelo/chunking). Reindexando do zero.')
+                return False
+
+            with open(self._cache_path(CACHE_CHUNKS_FILE), 'r', encoding='utf-8') as f:
+                self.text_chunks = {int(chunk_id): chunk for chunk_id, chunk in json.load(f).items()}
+
+            self.faiss_index = self._read_cached_index(writable=False)
+            self.documents = manifest["documents"]
+            self.next_chunk_id = manifest["next_chunk_id"]
+            logger.info('[RAG System] Cache carregado: %s documentos, %s vetores.', len(self.documents), self.faiss_index.ntotal)
+            return True
+
+        except Exception as e:
+            logger.error('[RAG System] Erro ao carregar o cache do RAG (%s). Reindexando do zero.', e)
+            self.faiss_index = None
+            self.text_chunks = {}
+            self.documents = {}
+            self.next_chunk_id = 0
+            return False
+
+    def _save_cache(self):
+        os.makedirs(self._resolve_path(self.cache_directory), exist_ok=True)
+        manifest = {
+            "settings": self._cache_settings(),
+            "documents": self.documents,
+            "next_chunk_id": self.next_chunk_id,
+        }
+
+        def write_json(data):
+            def write(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+            return write
+
+        # O manifesto é gravado por último: se o processo cair no meio, o próximo start reindexa o que faltar
+        _atomic_write(self._cache_path(CACHE_INDEX_FILE), lambda tmp_path: faiss.write_index(self.faiss_index, tmp_path))
+        _atomic_write(self._cache_path(CACHE_CHUNKS_FILE), write_json({str(chunk_id): chunk for chunk_id, chunk in self.text_chunks.items()}))
+        _atomic_write(self._cache_path(CACHE_MANIFEST_FILE), write_json(manifest))
+        logger.info('[RAG System] Cache do RAG salvo em: %s', self._resolve_path(self.cache_directory))
+
+    # --- Atualização incremental por documento ---
+
+    def _new_index(self, num_training_vectors: int = 0):
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        return index_backends.build_index(self.index_backend, dimension, num_training_vectors)
+
+    def _train_index_if_needed(self):
+        """Backends IVF só são treinados depois que os embeddings da indexação inicial estão prontos."""
+        if self.faiss_index.is_trained or not self._untrained_batches:
+            return
+        ids = np.concatenate([batch_ids for batch_ids, _ in self._untrained_batches])
+        embeddings = np.vstack([batch_embeddings for _, batch_embeddings in self._untrained_batches])
+        self._untrained_batches = []
+
+        if len(ids) < index_backends.min_training_vectors(self.index_backend):
+            logger.warning("[RAG System] Apenas %s vetores: insuficiente para treinar o backend '%s'. Usando índice exato (flat).", len(ids), self.index_backend)
+            self.faiss_index = index_backends.build_index("flat", embeddings.shape[1])
+        else:
+            logger.info("[RAG System] Treinando índice '%s' com %s vetores...", self.index_backend, len(ids))
+            self.faiss_index = self._new_index(num_training_vectors=len(ids))
+            self.faiss_index.train(embeddings)
+        self.faiss_index.add_with_ids(embeddings, ids)
+
+    def _remove_documents(self, doc_names: list[str]):
+        removed_ids = []
+        for doc_name in doc_names:
+            doc = self.documents.pop(doc_name)
+            ids = np.arange(doc["first_id"], doc["first_id"] + doc["num_chunks"], dtype='int64')
+            for chunk_id in ids:
+                self.text_chunks.pop(int(chunk_id), None)
+            removed_ids.append(ids)
+            logger.info('[RAG System] Documento removido do índice: %s (%s chunks)', doc_name, len(ids))
+
+        removed_ids = np.concatenate(removed_ids) if removed_ids else np.zeros(0, dtype='int64')
+        if len(removed_ids) == 0:
+            return
+        if index_backends.supports_removal(self.index_backend):
+            self.faiss_index.remove_ids(removed_ids)
+        else:
+            # HNSW não remove vetores: reconstrói o grafo com os vetores que continuam na base
+            ids, vectors = index_backends.index_vectors(self.faiss_index)
+            keep = ~np.isin(ids, removed_ids)
+            self.faiss_index = self._new_index()
+            if keep.any():
+                self.faiss_index.add_with_ids(vectors[keep], ids[keep])
+            logger.info("[RAG System] Índice '%s' reconstruído com %s vetores após remoções.", self.index_backend, int(keep.sum()))
+
+    def _add_document(self, doc_name: str, text_pieces: Iterable[str], doc_hash: str):
+        """Indexa um documento a partir do seu texto em pedaços, gerando os embeddings em lotes à medida que os chunks ficam prontos."""
+        first_id = self.next_chunk_id
+        chunks = self._iter_chunks(text_pieces)
+
+        while True:
+            batch_chunks = list(itertools.islice(chunks, EMBEDDING_BATCH_SIZE))
+            if not batch_chunks:
+                break
+            embeddings = self.embed_texts(batch_chunks)
+            ids = np.arange(self.next_chunk_id, self.next_chunk_id + len(batch_chunks), dtype='int64')
+            if self.faiss_index.is_trained:
+                self.faiss_index.add_with_ids(embeddings, ids)
+            else:
+                self._untrained_batches.append((ids, embeddings))
+            for chunk_id, chunk in zip(ids, batch_chunks):
+                self.text_chunks[int(chunk_id)] = chunk
+            self.next_chunk_id += len(batch_chunks)
+
+        num_chunks = self.next_chunk_id - first_id
+        # Mesmo sem texto o documento entra no manifesto, para não ser reprocessado a cada start
+        self.documents[doc_name] = {"hash": doc_hash, "first_id": first_id, "num_chunks": num_chunks}
+        logger.info('[RAG System] Documento indexado: %s (%s chunks)', doc_name, num_chunks)
+
+    def _add_documents(self, pdf_files: dict[str, str], doc_hashes: dict[str, str]):
+        """Indexa vários documentos: a extração roda em paralelo e alimenta o chunker e os embeddings em fluxo contínuo."""
+        start_time = time.perf_counter()
+        seen_docs = set()
+        extracted = self._iter_extracted_texts(pdf_files)
+        for doc_name, group in itertools.groupby(extracted, key=lambda item: item[0]):
+            self._add_document(doc_name, (text for _, text in group), doc_hashes[doc_name])
+            seen_docs.add(doc_name)
+        # PDFs sem nenhuma página legível não geram blocos de extração
+        for doc_name in pdf_files:
+            if doc_name not in seen_docs:
+                self._add_document(doc_name, [], doc_hashes[doc_name])
+        self._train_index_if_needed()
+        logger.info('[RAG System] %s documento(s) indexado(s) em %.1fs (%s processo(s) de extração).', len(pdf_files), time.perf_counter() - start_time, self.ingest_workers)
+
+    def _pending_changes(self, current_hashes: dict[str, str]) -> tuple[list[str], list[str], list[str]]:
+        """(removidos, alterados, novos) entre os PDFs atuais e os documentos do índice carregado."""
+        removed_docs = [doc_name for doc_name in self.documents if doc_name not in current_hashes]
+        changed_docs = [doc_name for doc_name, doc_hash in current_hashes.items()
+                        if doc_name in self.documents and self.documents[doc_name]["hash"] != doc_hash]
+        added_docs = [doc_name for doc_name in current_hashes if doc_name not in self.documents]
+        return removed_docs, changed_docs, added_docs
+
+    def _initialize_rag(self):
+        try:
+            pdf_files = self._list_knowledge_base_pdfs()
+
+            if not pdf_files:
+                logger.warning('[RAG System] Não foi possível encontrar nenhum documento na pasta. Configuração do RAG falhou.')
+                self.embedding_model = None
+                self.faiss_index = None
+                return
+
+            logger.info('[RAG System] Carregando modelo de embedding: %s...', self.embedding_model_name)
+            self.embedding_model = SentenceTransformer(self.embedding_model_name)
+            logger.info('[RAG System] Modelo de embedding carregado.')
+
+            current_hashes = {doc_name: _file_sha256(pdf_path) for doc_name, pdf_path in pdf_files.items()}
+            with self._cache_lock(exclusive=False):
+                self._load_cache()
+
+            if self.faiss_index is None or any(self._pending_changes(current_hashes)):
+                # Só um processo reindexa; os outros esperam o lock e recarregam o cache que ele salvou
+                with self._cache_lock(exclusive=True):
+                    self._load_cache()
+                    removed_docs, changed_docs, added_docs = self._pending_changes(current_hashes)
+                    if removed_docs or changed_docs or added_docs or self.faiss_index is None:
+                        logger.info('[RAG System] Atualizando índice: %s novo(s), %s alterado(s), %s removido(s).', len(added_docs), len(changed_docs), len(removed_docs))
+
+                        if self.faiss_index is None:
+                            self.faiss_index = self._new_index()
+                        else:
+                            # O índice carregado via mmap é somente leitura; reabre em memória para poder alterá-lo
+                            self.faiss_index = self._read_cached_index(writable=True)
+
+                        self._remove_documents(removed_docs + changed_docs)
+                        docs_to_add = changed_docs + added_docs
+                        self._add_documents({doc_name: pdf_files[doc_name] for doc_name in docs_to_add}, current_hashes)
+
+                        self._save_cache()
+                    else:
+                        logger.info('[RAG System] Índice atualizado por outro processo. Usando índice do cache.')
+            else:
+                logger.info('[RAG System] Base de conhecimento sem alterações. Usando índice do cache.')
+
+            index_backends.set_search_params(self.faiss_index, nprobe=self.nprobe, ef_search=self.ef_search)
+            index_backends.enable_reconstruct(self.faiss_index)
+            self.index_version = self._compute_index_version()
+            logger.info("[RAG System] Índice FAISS ('%s') pronto. Total de vetores: %s", self.index_backend, self.faiss_index.ntotal)
+
+            if self.text_chunks:
+                logger.info('[RAG System] Configuração do RAG concluída com sucesso!')
+            else:
+                logger.warning('[RAG System] Nenhum chunk foi criado. Configuração do RAG falhou.')
+                self.embedding_model = None
+                self.faiss_index = None
+
+        except Exception as e:
+            logger.error('[RAG System] Ocorreu um erro durante a inicialização do RAG: %s', e)
+            self.embedding_model = None
+            self.faiss_index = None
+            self.text_chunks = {}
+            logger.warning('[RAG System] Inicialização do RAG falhou.')
+
+    def is_ready(self, check_embeddings=True):
+        """Verifica se o RAG está pronto, opcionalmente checando se há embeddings."""
+        if check_embeddings:
+             return self.embedding_model is not None and self.faiss_index is not None and self.text_chunks is not None and len(self.text_chunks) > 0 and self.faiss_index.ntotal > 0
+        else:
+             # Verifica apenas se o modelo de embedding e o índice existem (pode ser útil mesmo com base vazia para outras buscas)
+             return self.embedding_model is not None and self.faiss_index is not None
+
+
+    # Retorna os chunks de texto baseados em IDs
+    def get_chunks_by_ids(self, ids: list[int]) -> list[str]:
+         if not self.text_chunks:
+              return []
+         # Os IDs não são mais contínuos (documentos removidos deixam lacunas), por isso a busca é pelo dicionário
+         return [self.text_chunks[int(id)] for id in ids if int(id) in self.text_chunks]
+
+
+    # Metadados e vetores dos chunks já indexados, usados no rerank (MMR) e na montagem do contexto
+    def get_chunk_documents(self, ids: list[int]) -> dict[int, str]:
+        """Retorna {ID do chunk: nome do PDF de origem} (os IDs de cada documento formam um intervalo contínuo)."""
+        chunk_documents = {}
+        for chunk_id in ids:
+            for doc_name, doc in self.documents.items():
+                if doc["first_id"] <= int(chunk_id) < doc["first_id"] + doc["num_chunks"]:
+                    chunk_documents[int(chunk_id)] = doc_name
+                    break
+        return chunk_documents
+
+    def get_chunk_embeddings(self, ids: list[int]) -> np.ndarray:
+        """
+        Embeddings normalizados dos chunks, lidos do próprio índice FAISS (sem passar pelo modelo nem pelo cache LRU).
+        Se o índice não conseguir reconstruí-los, gera com o modelo.
+        """
+        try:
+            return index_backends.reconstruct_vectors(self.faiss_index, ids)
+        except RuntimeError as e:
+            logger.warning('[RAG System] Não foi possível ler os vetores do índice (%s). Gerando com o modelo.', e)
+            return self.embed_texts(self.get_chunks_by_ids(ids))
+
+    def search_chunks_ranked(self, query_embeddings: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """
+        Busca os k chunks mais relevantes para todos os embeddings de uma vez (uma única chamada ao FAISS).
+        Os resultados são combinados pelo maior score de cada chunk e retornados como [(ID, score)], do mais relevante ao menos.
+        """
+        if not self.is_ready(check_embeddings=True):
+            logger.warning('[RAG System] RAG não inicializado/pronto para busca. Pulando busca FAISS.')
+            return []
+        if query_embeddings is None or query_embeddings.shape[0] == 0:
+             logger.warning('[RAG System] Embeddings de busca vazios. Pulando busca FAISS.')
+             return []
+
+        try:
+            logger.debug('[RAG System] Buscando no índice FAISS com %s embedding(s) (top %s)...', query_embeddings.shape[0], k)
+            # search retorna scores e ids. ids[i][j] é o j-ésimo vizinho mais próximo da i-ésima query
+            with timed("faiss_search"):
+                scores, ids = self.faiss_index.search(index_backends.normalize(query_embeddings), k)
+
+            best_scores = {}
+            for chunk_id, score in zip(ids.ravel(), scores.ravel()):
+                if chunk_id == -1: # IDs inválidos (menos de k resultados)
+                    continue
+                chunk_id = int(chunk_id)
+                if score > best_scores.get(chunk_id, -np.inf):
+                    best_scores[chunk_id] = float(score)
+
+            ranked = sorted(best_scores.items(), key=lambda item: item[1], reverse=True)
+            logger.debug('[RAG System] Encontrado %s IDs únicos relevantes na busca FAISS.', len(ranked))
+            return ranked
+
+        except Exception as e:
+            logger.error('[RAG System] Erro durante a busca FAISS com embeddings: %s', e)
+            return []
+
+    # Busca os k chunks mais relevantes na base de conhecimento usando embedding(s)
+    def search_chunks_with_embeddings(self, query_embeddings: np.ndarray, k: int) -> list[int]:
+        """Retorna os IDs únicos encontrados para todos os embeddings, ordenados pelo score (mais relevante primeiro)."""
+        return [chunk_id for chunk_id, _ in self.search_chunks_ranked(query_embeddings, k)]
+
+    # Gera embeddings normalizados (float32, norma 1), no mesmo espaço dos vetores do índice
+    def embed_texts(self, texts: list[str]) -> np.ndarray:
+        return index_backends.normalize(self.embedding_model.encode(texts, convert_to_numpy=True))
+
+    def embed_texts_cached(self, texts: list[str]) -> np.ndarray:
+        """
+        Igual a embed_texts, mas consulta um cache LRU (chave: hash do texto) antes de chamar o modelo.
+        Os textos que faltam no cache são codificados juntos, em um único lote.
+        """
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        embeddings = [None] * len(texts)
+        missing = {}
+
+        with self._embedding_cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._embedding_cache:
+                    self._embedding_cache.move_to_end(key)
+                    embeddings[i] = self._embedding_cache[key]
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            missing_keys = list(missing)
+            with timed("embedding_encode"):
+                new_embeddings = self.embed_texts([texts[missing[key][0]] for key in missing_keys])
+            with self._embedding_cache_lock:
+                for key, embedding in zip(missing_keys, new_embeddings):
+                    for i in missing[key]:
+                        embeddings[i] = embedding
+                    self._embedding_cache[key] = embedding
+                    self._embedding_cache.move_to_end(key)
+                while len(self._embedding_cache) > self.embedding_cache_size:
+                    self._embedding_cache.popitem(last=False)
+
+        logger.debug('[RAG System] Embeddings de busca: %s do cache, %s gerado(s).', len(texts) - sum(len(positions) for positions in missing.values()), len(missing))
+        if not embeddings:
+            return np.zeros((0, self.embedding_model.get_sentence_embedding_dimension()), dtype='float32')
+        return np.vstack(embeddings)
+
+    # Método para gerar embedding para um texto (útil para embeddings de query e arquivo)
+    def generate_embedding(self, text: str) -> np.ndarray | None:
+        if not self.embedding_model:
+            logger.warning('[RAG System] Modelo de embedding não carregado. Não é possível gerar embedding.')
+            return None
+        if not text or not text.strip():
+             logger.warning('[RAG System] Texto vazio para gerar embedding.')
+             return None
+        try:
+            logger.debug('[RAG System] Gerando embedding para texto fornecido...')
+            embedding = self.embed_texts_cached([text])
+            logger.debug('[RAG System] Embedding gerado.')
+            return embedding
+        except Exception as e:
+             logger.error('[RAG System] Erro ao gerar embedding: %s', e)
+             return None
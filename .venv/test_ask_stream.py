@@ -0,0 +1,155 @@
+"""
+Testes do /ask_stream sem rede, com o backend de IA fake: ordem dos eventos, tempo até o primeiro token
+e cancelamento quando o cliente desconecta.
+
+    python -m pytest test_ask_stream.py
+
+Precisa das dependências do app (Flask, FAISS, sentence-transformers, pypdf, pytesseract); o processing.py é
+substituído por um módulo vazio (os testes não anexam arquivos) e a base de conhecimento usada é um diretório vazio,
+então o modelo de embedding não é carregado.
+"""
+import importlib
+import json
+import os
+import sys
+import time
+import types
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("pypdf")
+pytest.importorskip("pytesseract")
+
+from llm_backends import FakeLLMBackend
+
+TOKEN_DELAY = 0.1 # A resposta fake tem ~25 palavras: ~2.5s para o stream completo
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    root = tmp_path_factory.mktemp("ask_stream")
+    os.makedirs(root / "knowledge_base")
+    processing_stub = types.ModuleType("processing")
+    processing_stub.process_image_with_ocr = lambda uploaded_file: ""
+    processing_stub.process_uploaded_pdf = lambda uploaded_file: ""
+
+    # O fixture é do módulo (o app é importado uma vez), então o monkeypatch de cada teste não serve aqui
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("LLM_BACKEND", "fake")
+        mp.setenv("SECRET_KEY", "test")
+        mp.setenv("KB_DIRECTORY", str(root / "knowledge_base"))
+        mp.setenv("RAG_CACHE_DIRECTORY", str(root / "rag_cache"))
+        mp.setenv("DOCUMENT_STORE_PATH", str(root / "session_documents.sqlite3"))
+        mp.setitem(sys.modules, "processing", processing_stub)
+        for module_name in ("app", "upload_jobs"): # Reimportados com o ambiente e o stub acima; removidos ao final
+            mp.delitem(sys.modules, module_name, raising=False)
+
+        app_module = importlib.import_module("app")
+        app_module.app.config["TESTING"] = True
+        yield app_module
+        for module_name in ("app", "upload_jobs"):
+            sys.modules.pop(module_name, None)
+
+
+@pytest.fixture
+def client(app_module):
+    app_module.llm_backend = FakeLLMBackend(token_delay=TOKEN_DELAY)
+    return app_module.app.test_client()
+
+
+def _parse_events(chunks) -> list[tuple[str, dict]]:
+    text = "".join(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk for chunk in chunks)
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _chat_history(app_module, client) -> list[dict]:
+    with client.session_transaction() as sess:
+        return app_module.document_store.get_chat_history(sess.get("session_key"))
+
+
+def test_events_in_order_and_turn_saved(app_module, client):
+    app_module.llm_backend = FakeLLMBackend()
+    response = client.post("/ask_stream", data={"user_input": "Quantos dias de férias eu tenho?"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    events = _parse_events([response.get_data()])
+    names = [name for name, _ in events]
+    assert names[0] == "metadata"
+    assert names[-1] == "done"
+    assert set(names[1:-1]) == {"token"} and len(names) > 3
+
+    answer = "".join(data["text"] for name, data in events if name == "token")
+    assert events[-1][1]["response"] == answer
+    assert _chat_history(app_module, client)[-1] == {"user": "Quantos dias de férias eu tenho?", "ai": answer}
+
+
+def test_first_token_arrives_before_the_stream_ends(client):
+    start_time = time.perf_counter()
+    response = client.post("/ask_stream", data={"user_input": "O que é rescisão?"}, buffered=False)
+    chunks = iter(response.response)
+    first_events = _parse_events([next(chunks), next(chunks)])
+    time_to_first_token = time.perf_counter() - start_time
+    response.close()
+
+    assert [name for name, _ in first_events] == ["metadata", "token"]
+    assert time_to_first_token < 10 * TOKEN_DELAY
+
+
+def test_disconnect_stops_generation_and_does_not_save_turn(app_module, client):
+    generated = []
+
+    class RecordingBackend(FakeLLMBackend):
+        def stream(self, prompt):
+            for piece in super().stream(prompt):
+                generated.append(piece)
+                yield piece
+
+    app_module.llm_backend = RecordingBackend(token_delay=TOKEN_DELAY)
+    response = client.post("/ask_stream", data={"user_input": "Qual a multa por dirigir sem habilitação?"}, buffered=False)
+    chunks = iter(response.response)
+    next(chunks) # metadata
+    next(chunks) # primeiro token
+    response.close() # Cliente desconecta
+
+    assert _chat_history(app_module, client) == []
+    pieces_at_close = len(generated)
+    time.sleep(3 * TOKEN_DELAY)
+    assert len(generated) == pieces_at_close # A geração parou junto com a conexão
+
+
+def test_interrupted_stream_emits_error_event(app_module, client):
+    from llm_backends import LLMResponseInterrupted
+
+    class InterruptedBackend(FakeLLMBackend):
+        def stream(self, prompt):
+            yield "Resposta"
+            raise LLMResponseInterrupted("A resposta da IA foi interrompida antes do fim e pode estar incompleta.")
+
+    app_module.llm_backend = InterruptedBackend()
+    events = _parse_events([client.post("/ask_stream", data={"user_input": "Como funciona a guarda compartilhada?"}).get_data()])
+
+    assert [name for name, _ in events] == ["metadata", "token", "error", "done"]
+    assert events[2][1]["message"].startswith("A resposta da IA foi interrompida")
+
+
+def test_empty_response_emits_error_event(app_module, client):
+    from llm_backends import LLMEmptyResponse
+
+    class BlockedBackend(FakeLLMBackend):
+        def stream(self, prompt):
+            raise LLMEmptyResponse("Desculpe, não consegui gerar uma resposta para isso no momento.")
+            yield
+
+    app_module.llm_backend = BlockedBackend()
+    events = _parse_events([client.post("/ask_stream", data={"user_input": "Pergunta bloqueada"}).get_data()])
+
+    assert [name for name, _ in events] == ["metadata", "error", "done"]
+    assert events[-1][1]["response"].startswith("Desculpe, não consegui gerar uma resposta")
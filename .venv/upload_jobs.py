@@ -0,0 +1,298 @@
+import os
+import time
+import logging
+import uuid
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pypdf
+import pytesseract
+from werkzeug.datastructures import FileStorage
+
+try:
+    import pypdfium2 as pdfium
+except ImportError: # Opcional: sem ele, o OCR de PDFs usa só as imagens embutidas nas páginas
+    pdfium = None
+
+from processing import process_image_with_ocr
+from metrics import stage_metrics, timed
+
+logger = logging.getLogger(__name__)
+
+OCR_LANGUAGE = "por" # Idioma do Tesseract para as páginas escaneadas (pacote tesseract-ocr-por)
+OCR_RENDER_DPI = 300 # Resolução das páginas renderizadas para o OCR
+NO_TEXT_PDF_MESSAGE = "O PDF anexado não contém texto legível"
+PAGES_PER_EXTRACTION_TASK = 16 # Páginas extraídas por tarefa enviada ao pool (como no rag.py)
+JOB_RETENTION_SECONDS = 3600 # Jobs finalizados ficam consultáveis por este tempo
+RESULT_CACHE_SIZE = 256 # Resultados guardados por hash do conteúdo (reenvio do mesmo arquivo é instantâneo)
+JOB_POLL_INTERVAL = 0.2 # Segundos entre consultas ao banco ao esperar um job de outro processo
+
+# Mesma configuração do processing.py: caminho do executável do Tesseract, se não estiver no PATH
+if os.getenv("TESSERACT_PATH"):
+    pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_PATH")
+
+
+# --- Tarefas executadas nos processos do pool (precisam ser funções de módulo) ---
+# Recebem o caminho do arquivo temporário do upload, não os bytes: cada tarefa lê só o que precisa
+
+def _process_image(file_path: str, file_name: str, content_type: str) -> str:
+    """Reconstrói o upload a partir do arquivo e usa a mesma função de processing.py que o /ask usava."""
+    with open(file_path, 'rb') as file:
+        return process_image_with_ocr(FileStorage(stream=file, filename=file_name, content_type=content_type))
+
+
+def _count_pdf_pages(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(pypdf.PdfReader(file).pages)
+
+
+def _extract_pdf_page_texts(file_path: str, start_page: int, end_page: int) -> list[str]:
+    """Texto de cada página [start_page, end_page); '' para páginas sem camada de texto (ou cuja extração falhou)."""
+    page_texts = []
+    with open(file_path, 'rb') as file:
+        reader = pypdf.PdfReader(file)
+        for page_num in range(start_page, end_page):
+            try:
+                page_texts.append((reader.pages[page_num].extract_text() or "").strip())
+            except Exception as e:
+                logger.warning('[Upload Jobs] Extração de texto da página %s falhou (vai para o OCR): %s', page_num + 1, e)
+                page_texts.append("")
+    return page_texts
+
+
+def _render_pdf_page(file_path: str, page_num: int):
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return pdf[page_num].render(scale=OCR_RENDER_DPI / 72).to_pil()
+    finally:
+        pdf.close()
+
+
+def _embedded_page_images(file_path: str, page_num: int) -> list:
+    """
+    Imagens embutidas na página, para quando ela não pode ser renderizada. Cobre só o caso comum de digitalização
+    (uma imagem por página): imagens que o Pillow não decodifica (ex: JBIG2) são ignoradas, e páginas montadas em
+    faixas têm cada faixa OCR'izada separadamente.
+    """
+    with open(file_path, 'rb') as file:
+        page = pypdf.PdfReader(file).pages[page_num]
+        images = []
+        for image_num, page_image in enumerate(page.images):
+            try:
+                images.append(page_image.image)
+            except Exception as e:
+                logger.warning('[Upload Jobs] Imagem %s da página %s não pôde ser decodificada: %s', image_num, page_num + 1, e)
+        return images
+
+
+def _ocr_pdf_page(file_path: str, page_num: int) -> str:
+    """OCR de uma página de PDF renderizada (pypdfium2); sem o renderizador, OCR das imagens embutidas na página."""
+    images = None
+    if pdfium is not None:
+        try:
+            images = [_render_pdf_page(file_path, page_num)]
+        except Exception as e:
+            logger.warning('[Upload Jobs] Não foi possível renderizar a página %s; usando as imagens embutidas: %s', page_num + 1, e)
+    if images is None:
+        images = _embedded_page_images(file_path, page_num)
+
+    page_texts = []
+    for image in images:
+        text = pytesseract.image_to_string(image, lang=OCR_LANGUAGE).strip()
+        if text:
+            page_texts.append(text)
+    return "\n".join(page_texts)
+
+
+def _create_process_pool(max_workers: int) -> Executor:
+    # O pool é criado a partir de uma thread do servidor (que tem outras threads e locks ativos), onde fork não é seguro.
+    # forkserver (Unix) ou spawn (Windows) iniciam processos limpos; eles reimportam o script principal como
+    # __mp_main__, e o app.py pula a inicialização da IA e do RAG nesse caso
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+
+
+class UploadJobManager:
+    """
+    Processa os arquivos anexados (OCR de imagens e extração de PDFs) fora da thread da requisição.
+    Cada upload vira um job com ID; o processamento roda em um pool limitado de processos e
+    as páginas de PDF sem camada de texto são renderizadas e OCR'izadas em paralelo. Resultados ficam em cache pelo hash do conteúdo.
+    O estado dos jobs e o cache de resultados ficam em SQLite (db_path), então com vários workers (ex: gunicorn)
+    um job criado em um processo pode ser consultado e esperado em qualquer outro.
+    """
+
+    def __init__(self, db_path: str, max_workers: int | None = None, cache_size: int = RESULT_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self._pool = None
+        # Threads leves que coordenam cada job (esperam o pool e juntam as páginas)
+        self._coordinator = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="upload-job")
+        self._done_events = {} # ID do job -> threading.Event, para os jobs deste processo (espera sem consultar o banco)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS upload_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS upload_results (
+                    content_hash TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Uma conexão por thread, como no DocumentStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _get_pool(self) -> Executor:
+        # Criado na primeira utilização, para não iniciar processos que nunca serão usados
+        with self._lock:
+            if self._pool is None:
+                self._pool = _create_process_pool(self.max_workers)
+            return self._pool
+
+    def _cached_result(self, content_hash: str) -> str | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT result FROM upload_results WHERE content_hash = ?", (content_hash,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE upload_results SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash))
+        return row[0] if row else None
+
+    def _cache_result(self, content_hash: str, result: str):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO upload_results (content_hash, result, last_used) VALUES (?, ?, ?)", (content_hash, result, time.time()))
+            # LRU: mantém só os cache_size resultados usados mais recentemente
+            conn.execute("DELETE FROM upload_results WHERE content_hash NOT IN (SELECT content_hash FROM upload_results ORDER BY last_used DESC LIMIT ?)", (self.cache_size,))
+
+    def submit(self, file_bytes: bytes, file_name: str, content_type: str) -> str:
+        """Cria um job para o arquivo e retorna seu ID. Se o mesmo conteúdo já foi processado, o job já nasce concluído."""
+        content_hash = hashlib.sha256(content_type.encode('utf-8') + b"\0" + file_bytes).hexdigest()
+        job_id = uuid.uuid4().hex
+
+        with self._connection() as conn:
+            conn.execute("DELETE FROM upload_jobs WHERE finished_at < ?", (time.time() - JOB_RETENTION_SECONDS,))
+            conn.execute("INSERT INTO upload_jobs (job_id, status, file_name, content_type) VALUES (?, 'queued', ?, ?)", (job_id, file_name, content_type))
+        with self._lock:
+            self._done_events[job_id] = threading.Event()
+
+        cached_result = self._cached_result(content_hash)
+        if cached_result is not None:
+            logger.debug("[Upload Jobs] '%s' já processado anteriormente (cache por hash do conteúdo).", file_name)
+            self._finish(job_id, result=cached_result)
+        else:
+            self._coordinator.submit(self._run_job, job_id, file_name, content_type, file_bytes, content_hash)
+        return job_id
+
+    def _finish(self, job_id: str, result: str | None = None, error: str | None = None):
+        with self._connection() as conn:
+            conn.execute("UPDATE upload_jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                         ("error" if error else "done", result, error, time.time(), job_id))
+        with self._lock:
+            done_event = self._done_events.pop(job_id, None)
+        if done_event is not None:
+            done_event.set()
+
+    def _run_job(self, job_id: str, file_name: str, content_type: str, file_bytes: bytes, content_hash: str):
+        with self._connection() as conn:
+            conn.execute("UPDATE upload_jobs SET status = 'running' WHERE job_id = ?", (job_id,))
+        start_time = time.perf_counter()
+        try:
+            pool = self._get_pool()
+            # Gravado uma vez; as tarefas do pool recebem só o caminho (não uma cópia dos bytes por tarefa)
+            with tempfile.NamedTemporaryFile(prefix="upload-", suffix=os.path.splitext(file_name)[1], delete=False) as tmp_file:
+                tmp_file.write(file_bytes)
+            try:
+                if content_type.startswith('image/'):
+                    result = pool.submit(_process_image, tmp_file.name, file_name, content_type).result()
+                else:
+                    result = self._process_pdf(pool, tmp_file.name, file_name)
+            finally:
+                os.remove(tmp_file.name)
+
+            if not result.startswith("Erro"): # Erros podem ser transitórios; não ficam em cache
+                self._cache_result(content_hash, result)
+            self._finish(job_id, result=result)
+            stage_metrics.observe("upload_job", time.perf_counter() - start_time)
+            logger.debug("[Upload Jobs] '%s' processado em %.1fs.", file_name, time.perf_counter() - start_time)
+        except Exception as e:
+            logger.error("[Upload Jobs] Erro ao processar '%s': %s", file_name, e)
+            self._finish(job_id, error=f"Erro ao processar o arquivo anexado: {e}")
+
+    def _process_pdf(self, pool: Executor, file_path: str, file_name: str) -> str:
+        """
+        Extrai o texto página a página (blocos de páginas em paralelo) e aplica OCR, também em paralelo, só nas páginas
+        sem camada de texto, então PDFs escaneados e mistos são cobertos. Páginas cujo OCR falha são puladas.
+        """
+        try:
+            num_pages = pool.submit(_count_pdf_pages, file_path).result()
+        except Exception as e:
+            logger.error("[Upload Jobs] Não foi possível ler o PDF '%s': %s", file_name, e)
+            return f"Erro ao ler o PDF anexado: {e}"
+
+        block_futures = [pool.submit(_extract_pdf_page_texts, file_path, start_page, min(start_page + PAGES_PER_EXTRACTION_TASK, num_pages))
+                         for start_page in range(0, num_pages, PAGES_PER_EXTRACTION_TASK)]
+        page_texts = [page_text for future in block_futures for page_text in future.result()]
+
+        pages_without_text = [page_num for page_num, page_text in enumerate(page_texts) if not page_text]
+        if pages_without_text:
+            logger.debug("[Upload Jobs] '%s': %s de %s página(s) sem camada de texto. Aplicando OCR em paralelo...", file_name, len(pages_without_text), num_pages)
+            with timed("pdf_ocr"):
+                ocr_futures = {page_num: pool.submit(_ocr_pdf_page, file_path, page_num) for page_num in pages_without_text}
+                failed_pages = 0
+                for page_num, future in ocr_futures.items():
+                    try:
+                        page_texts[page_num] = future.result()
+                    except Exception as e:
+                        failed_pages += 1
+                        logger.warning("[Upload Jobs] OCR da página %s de '%s' falhou: %s", page_num + 1, file_name, e)
+            if failed_pages:
+                logger.warning("[Upload Jobs] OCR de '%s': %s de %s página(s) com erro.", file_name, failed_pages, len(pages_without_text))
+
+        text = "\n".join(page_text for page_text in page_texts if page_text)
+        return text or f"{NO_TEXT_PDF_MESSAGE}, nem mesmo com OCR."
+
+    def status(self, job_id: str) -> dict | None:
+        """Estado público do job: {"job_id", "status", "file_name", "content_type", "result", "error"} ou None se não existir."""
+        with self._connection() as conn:
+            row = conn.execute("SELECT status, file_name, content_type, result, error FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {"job_id": job_id, **dict(zip(("status", "file_name", "content_type", "result", "error"), row))}
+
+    def wait(self, job_id: str, timeout: float | None = None) -> dict | None:
+        """Espera o job terminar (ou o timeout) e retorna seu estado. Jobs de outros processos são acompanhados pelo banco."""
+        with self._lock:
+            done_event = self._done_events.get(job_id)
+        if done_event is not None:
+            done_event.wait(timeout)
+            return self.status(job_id)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.status(job_id)
+            if job is None or job["status"] in ("done", "error"):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(JOB_POLL_INTERVAL)